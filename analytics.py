@@ -0,0 +1,123 @@
+# analytics.py
+"""
+Dashboard queries. Every side of a join is aggregated down to one row per
+course or per student first (mostly from the trigger-maintained summary
+tables), so no query ever multiplies enrollments by attendance rows.
+
+Attendance percentages are attended sessions over possible sessions:
+enrolled students x sessions held for a course, and the sessions held by
+each enrolled course for a student.
+"""
+
+LOW_ATTENDANCE_PERCENT = 25
+
+COURSES_SUMMARY = """
+    SELECT c.id AS course_id, c.name, l.username AS lecturer,
+           COALESCE(e.students, 0) AS student_count,
+           COALESCE(ROUND(s.records * 100.0 / NULLIF(e.students * s.sessions, 0), 2), 0)
+               AS average_attendance
+    FROM courses c
+    LEFT JOIN lecturers l ON l.id = c.lecturer_id
+    LEFT JOIN (SELECT course_id, COUNT(*) AS students
+               FROM student_courses GROUP BY course_id) e ON e.course_id = c.id
+    LEFT JOIN (SELECT course_id, COUNT(*) AS sessions, SUM(attendees) AS records
+               FROM course_sessions GROUP BY course_id) s ON s.course_id = c.id
+    ORDER BY c.id
+"""
+
+# Per student: sessions attended and sessions held across enrolled courses
+STUDENT_ATTENDANCE = """
+    SELECT sc.student_id,
+           SUM(COALESCE(sca.attended, 0)) AS attended,
+           SUM(COALESCE(cs.sessions, 0)) AS possible
+    FROM student_courses sc
+    LEFT JOIN (SELECT course_id, COUNT(*) AS sessions
+               FROM course_sessions GROUP BY course_id) cs ON cs.course_id = sc.course_id
+    LEFT JOIN student_course_attendance sca
+           ON sca.student_id = sc.student_id AND sca.course_id = sc.course_id
+    GROUP BY sc.student_id
+"""
+
+LOW_ATTENDANCE = f"""
+    SELECT s.id AS student_id, s.first_name || ' ' || s.last_name AS name,
+           s.matric_number,
+           t.attended AS attended_sessions,
+           ROUND(t.attended * 100.0 / t.possible, 2) AS percentage
+    FROM ({STUDENT_ATTENDANCE}) t
+    JOIN students s ON s.id = t.student_id
+    WHERE t.possible > 0 AND t.attended * 100.0 / t.possible <= ?
+    ORDER BY percentage, s.id
+"""
+
+
+def courses_summary(conn):
+    """Enrolled students and average attendance (%) for every course"""
+    return [dict(r) for r in conn.execute(COURSES_SUMMARY)]
+
+
+def low_attendance(conn, threshold=LOW_ATTENDANCE_PERCENT):
+    """
+    Students at or below `threshold` percent of the sessions held in their
+    courses. Students whose courses have not met yet are left out.
+    """
+    return [dict(r) for r in conn.execute(LOW_ATTENDANCE, (threshold,))]
+
+
+# -------------------------------
+# Department summary
+# -------------------------------
+FETCH_ROWS = 500  # rows pulled from SQLite per fetchmany while streaming
+
+COURSE_STATS = """
+    SELECT c.id AS course_id, c.name AS course_name,
+           COUNT(cs.session_date) AS sessions,
+           COALESCE(SUM(cs.attendees), 0) AS attendance_records
+    FROM courses c
+    LEFT JOIN course_sessions cs ON cs.course_id = c.id
+    GROUP BY c.id
+    ORDER BY c.id
+"""
+
+# Keyset page: students after a given id, in id order
+STUDENT_STATS = """
+    SELECT s.id AS student_id, s.first_name || ' ' || s.last_name AS name,
+           s.matric_number, COALESCE(SUM(sca.attended), 0) AS total_attended
+    FROM students s
+    LEFT JOIN student_course_attendance sca ON sca.student_id = s.id
+    WHERE s.id > ?
+    GROUP BY s.id
+    ORDER BY s.id
+    LIMIT ?
+"""
+
+
+def _fetch(cursor):
+    """Yield rows as dicts, FETCH_ROWS at a time"""
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            return
+        for row in rows:
+            yield dict(row)
+
+
+def department_totals(conn):
+    return {
+        "total_courses": conn.execute("SELECT COUNT(*) FROM courses").fetchone()[0],
+        "total_students": conn.execute("SELECT COUNT(*) FROM students").fetchone()[0],
+        "total_attendance_records":
+            conn.execute("SELECT COALESCE(SUM(attendees), 0) FROM course_sessions").fetchone()[0],
+    }
+
+
+def course_stats(conn):
+    """Sessions held and attendance records for every course, in id order"""
+    return _fetch(conn.execute(COURSE_STATS))
+
+
+def student_stats(conn, after=0, limit=None):
+    """
+    Total sessions attended by each student with id > `after`, in id
+    order, at most `limit` of them (all when None)
+    """
+    return _fetch(conn.execute(STUDENT_STATS, (after, -1 if limit is None else limit)))
@@ -1,11 +1,12 @@
 from flask import Flask
 from flask_cors import CORS
-from db import init_db
+from db import init_db, init_app
 from auth import auth_bp
 from courses import courses_bp
 from students import students_bp
 from attendance import attendance_bp
 from hod import hod_bp
+import write_behind
 
 
 app = Flask(__name__)
@@ -23,6 +24,9 @@ CORS(app, resources={
 
 # Initialize DB
 init_db()
+init_app(app)
+if write_behind.ENABLED:
+    write_behind.recover()
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix="/auth")
@@ -1,40 +1,158 @@
-from flask import Blueprint, request, jsonify, g
-import sqlite3, numpy as np
+from flask import Blueprint, Response, request, jsonify, g, stream_with_context
+import json, numpy as np, os, time
 from datetime import datetime
+from db import get_db, INSERT_ATTENDANCE
 from auth import token_required
+import analytics
+import cache
+import export
+import gallery
+import pipeline
+import recognition
+import roster
+import sessions
+import shards
+import wire
+import write_behind
 
 attendance_bp = Blueprint("attendance", __name__)
 
 # -------------------------------
-# Load known embeddings
+# Matching scope
 # -------------------------------
-EMBEDDINGS_FILE = "models/known_face_embeddings.npy"
-NAMES_FILE = "models/known_face_names.npy"
+# "department" matches against every registered face; "course" only against
+# students enrolled in the course being marked.
+MATCH_SCOPE = os.getenv("MATCH_SCOPE", "department")
+# In course scope, re-check misses against the whole department so the
+# response can still say "matched but not enrolled".
+REPORT_UNENROLLED = os.getenv("REPORT_UNENROLLED", "1") == "1"
 
-try:
-    known_face_embeddings = np.load(EMBEDDINGS_FILE, allow_pickle=True)
-    known_face_names = np.load(NAMES_FILE, allow_pickle=True)
-except Exception:
-    known_face_embeddings = np.array([])
-    known_face_names = np.array([])
+# Largest student_stats page /department_summary hands out
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
 
+_course_galleries = {}  # course_id -> (fingerprint, gallery snapshot)
 
-def find_best_match(embedding, threshold=0.6):
+
+@attendance_bp.errorhandler(recognition.Overloaded)
+@attendance_bp.errorhandler(recognition.DeadlineExceeded)
+def recognition_busy(e):
+    """The recognition pool is full or too slow right now; ask the client to back off"""
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(recognition.RETRY_AFTER_S)}
+
+
+def find_best_match(embedding, threshold=0.6, snapshot=None):
     """
     Find the closest student by comparing embeddings.
     Returns (matric_number, distance) or (None, None) if no match.
     """
-    if len(known_face_embeddings) == 0:
-        return None, None
+    return find_best_matches(np.asarray(embedding, dtype=np.float32)[None], threshold, snapshot)[0]
 
-    embedding = np.array(embedding)
-    distances = np.linalg.norm(known_face_embeddings - embedding, axis=1)
-    min_index = np.argmin(distances)
-    min_distance = distances[min_index]
 
-    if min_distance <= threshold:
-        return known_face_names[min_index], float(min_distance)
-    return None, None
+def find_best_matches(embeddings, threshold=0.6, snapshot=None):
+    """
+    Batch version of find_best_match for several faces from one frame.
+    Returns a list of (matric_number, distance) or (None, None) per face.
+    Whole-gallery searches are scattered to the shard servers with
+    GALLERY_SHARDS, or run in the recognition pool with MATCH_IN_POOL.
+    """
+    if snapshot is None and shards.ENABLED:
+        nearest = shards.match(embeddings)
+    elif snapshot is None and recognition.MATCH_IN_POOL:
+        nearest = recognition.match(embeddings)
+    else:
+        nearest = gallery.nearest_many(embeddings, snapshot)
+    return [
+        (matric_number, distance) if matric_number is not None and distance <= threshold
+        else (None, None)
+        for matric_number, distance in nearest
+    ]
+
+
+def course_gallery(cursor, course_id):
+    """
+    Gallery snapshot of the students enrolled in a course, cached until
+    enrollment or the gallery itself changes.
+    """
+    current = roster.current(cursor)
+    fingerprint = (current.version, gallery.version())
+
+    cached = _course_galleries.get(course_id)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+
+    snapshot = gallery.subset(current.members(course_id))
+    _course_galleries[course_id] = (fingerprint, snapshot)
+    return snapshot
+
+
+def match_for_course(cursor, course_id, embeddings):
+    """
+    Match a batch of faces for marking `course_id`, honouring MATCH_SCOPE.
+    Returns a list of (matric_number, distance) or (None, None) per face.
+    """
+    if MATCH_SCOPE != "course":
+        return find_best_matches(embeddings)
+
+    embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, gallery.EMBEDDING_DIM)
+    matches = find_best_matches(embeddings, snapshot=course_gallery(cursor, course_id))
+    misses = [i for i, (matric_number, _) in enumerate(matches) if matric_number is None]
+    if misses and REPORT_UNENROLLED:
+        # Only faces not found in the class pay for the department-wide scan
+        for i, match in zip(misses, find_best_matches(embeddings[misses])):
+            matches[i] = match
+    return matches
+
+
+def match_live(cursor, course_id, embeddings, live):
+    """
+    match_for_course(), answering faces seen moments ago from the live
+    session's similarity cache when a session is open
+    """
+    if live is None:
+        return match_for_course(cursor, course_id, embeddings)
+
+    embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, gallery.EMBEDDING_DIM)
+    matches = live.recall(embeddings)
+    unknown = [i for i, match in enumerate(matches) if match is None]
+    if unknown:
+        found = match_for_course(cursor, course_id, embeddings[unknown])
+        live.remember(embeddings[unknown], found)
+        for i, match in zip(unknown, found):
+            matches[i] = match
+    return matches
+
+
+def _course_id(value):
+    """A course id sent by a client as an int (or digit string), else None"""
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def record_attendance(cursor, student_ids, course_id, now):
+    """
+    Mark each student present for the session on `now`'s date.
+    Returns one bool per student: True if the mark is new, False if the
+    student was already marked; the unique index decides, so concurrent
+    markers cannot both succeed. All rows are committed together. In
+    write-behind mode the marks are queued and acknowledged once logged
+    instead of inserted here.
+    """
+    rows = [(student_id, course_id, now.strftime("%Y-%m-%d %H:%M:%S"), now.strftime("%Y-%m-%d"))
+            for student_id in student_ids]
+    if write_behind.ENABLED:
+        return write_behind.submit(cursor, rows)
+
+    marked = []
+    for row in rows:
+        cursor.execute(INSERT_ATTENDANCE, row)
+        marked.append(cursor.rowcount == 1)
+    cursor.connection.commit()
+    if any(marked):
+        cache.invalidate("attendance")
+    return marked
 
 
 # -------------------------------
@@ -43,107 +161,301 @@ def find_best_match(embedding, threshold=0.6):
 @attendance_bp.route("/mark", methods=["POST"])
 @token_required
 def mark_attendance():
-    data = request.json
-    course_id = data.get("course_id")
-    embedding = data.get("embedding")
-
-    if not course_id or embedding is None:
-        return jsonify({"error": "course_id and embedding required"}), 400
+    try:
+        data, body = wire.read_request()
+        data = data or {}
+        course_id = data.get("course_id")
+        embedding = body if body is not None else data.get("embedding")
+
+        if not course_id or embedding is None:
+            return jsonify({"error": "course_id and embedding required"}), 400
+        course_id = _course_id(course_id)
+        if course_id is None:
+            return jsonify({"error": "course_id must be an integer"}), 400
+        embedding = wire.to_matrix(embedding)
+    except wire.WireError as e:
+        return jsonify({"error": str(e)}), e.status
+    if len(embedding) != 1:
+        return jsonify({"error": "exactly one embedding required"}), 400
+
+    conn = get_db()
+    cursor = conn.cursor()
 
-    matric_number, distance = find_best_match(embedding)
+    live = sessions.get(cursor, course_id)
+    matric_number, distance = match_live(cursor, course_id, embedding, live)[0]
     if not matric_number:
         return jsonify({"error": "No matching student found"}), 404
 
-    conn = sqlite3.connect("attendance.db")
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT id, first_name, last_name FROM students WHERE matric_number=?", (matric_number,))
-    student = cursor.fetchone()
+    current = roster.current(cursor)
+    student = current.students([matric_number]).get(matric_number)
     if not student:
-        conn.close()
         return jsonify({"error": "Student not found in database"}), 404
 
-    student_id, first_name, last_name = student
+    student_id, name = student
 
     # ✅ Check enrollment
-    cursor.execute("SELECT 1 FROM student_courses WHERE student_id=? AND course_id=?", (student_id, course_id))
-    enrolled = cursor.fetchone()
-    if not enrolled:
-        conn.close()
+    if not current.enrolled(course_id, [student_id]):
         return jsonify({
             "match": True,
             "matric_number": matric_number,
-            "name": f"{first_name} {last_name}",
+            "name": name,
             "attendance_marked": False,
             "reason": "Student not enrolled in this course"
         })
 
-    # ✅ Prevent duplicates (same day)
-    cursor.execute("""SELECT 1 FROM attendance
-                      WHERE student_id=? AND course_id=?
-                      AND DATE(timestamp)=DATE('now')""",
-                   (student_id, course_id))
-    if cursor.fetchone():
-        conn.close()
+    # ✅ Prevent duplicates (same day), from memory while a session is open
+    if live is not None and live.already_marked(student_id):
+        marked = False
+    else:
+        marked = record_attendance(cursor, [student_id], course_id, datetime.now())[0]
+        if live is not None:
+            live.mark([student_id])
+    if not marked:
         return jsonify({
             "match": True,
             "matric_number": matric_number,
-            "name": f"{first_name} {last_name}",
+            "name": name,
             "attendance_marked": False,
             "reason": "Already marked today"
         })
 
-    cursor.execute(
-        "INSERT INTO attendance (student_id, course_id, timestamp) VALUES (?, ?, ?)",
-        (student_id, course_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
-    )
-    conn.commit()
-    conn.close()
-
     return jsonify({
         "match": True,
         "matric_number": matric_number,
-        "name": f"{first_name} {last_name}",
+        "name": name,
         "attendance_marked": True,
         "course_id": course_id,
         "distance": distance
     })
 
 
+def mark_faces(course_id, embeddings):
+    """
+    Match every face of one frame and mark the enrolled ones present.
+    Returns the /mark_batch response body.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+
+    live = sessions.get(cursor, course_id)
+    matches = match_live(cursor, course_id, embeddings, live)
+    current = roster.current(cursor)
+    students = current.students({m for m, _ in matches if m is not None})
+    enrolled = current.enrolled(course_id, (s[0] for s in students.values()))
+
+    results, to_mark = [], []
+    for matric_number, distance in matches:
+        if matric_number is None:
+            results.append({"match": False, "error": "No matching student found"})
+            continue
+        if matric_number not in students:
+            results.append({"match": False, "error": "Student not found in database"})
+            continue
+
+        student_id, name = students[matric_number]
+        result = {
+            "match": True,
+            "matric_number": matric_number,
+            "name": name,
+            "attendance_marked": False,
+        }
+        if student_id not in enrolled:
+            result["reason"] = "Student not enrolled in this course"
+        elif live is not None and live.already_marked(student_id):
+            result["reason"] = "Already marked today"
+        else:
+            to_mark.append((result, student_id, distance))
+        results.append(result)
+
+    # All of the frame's marks go in together (one transaction or one log write)
+    marked = record_attendance(cursor, [sid for _, sid, _ in to_mark], course_id, datetime.now())
+    if live is not None:
+        live.mark([sid for _, sid, _ in to_mark])
+    for (result, _, distance), is_new in zip(to_mark, marked):
+        if is_new:
+            result.update({"attendance_marked": True, "course_id": course_id, "distance": distance})
+        else:
+            # Also covers the same student appearing twice in one frame
+            result["reason"] = "Already marked today"
+    marked_count = sum(marked)
+
+    return {
+        "course_id": course_id,
+        "marked_count": marked_count,
+        "results": results
+    }
+
+
+# -------------------------------
+# Mark Attendance (batch, one classroom frame)
+# -------------------------------
+@attendance_bp.route("/mark_batch", methods=["POST"])
+@token_required
+def mark_attendance_batch():
+    try:
+        data, body = wire.read_request()
+        data = data or {}
+        course_id = data.get("course_id")
+        embeddings = body if body is not None else data.get("embeddings")
+
+        if not course_id or embeddings is None:
+            return jsonify({"error": "course_id and embeddings required"}), 400
+        course_id = _course_id(course_id)
+        if course_id is None:
+            return jsonify({"error": "course_id must be an integer"}), 400
+        embeddings = wire.to_matrix(embeddings)
+    except wire.WireError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    return jsonify(mark_faces(course_id, embeddings))
+
+
+# -------------------------------
+# Mark Attendance (server-side detection from a photo)
+# -------------------------------
+@attendance_bp.route("/mark_image", methods=["POST"])
+@token_required
+def mark_attendance_image():
+    upload = request.files.get("image")
+    image = upload.read() if upload else request.get_data()
+    course_id = request.form.get("course_id") or request.args.get("course_id")
+
+    if not course_id or not image:
+        return jsonify({"error": "course_id and image required"}), 400
+    if not str(course_id).isdigit():
+        return jsonify({"error": "course_id must be an integer"}), 400
+
+    try:
+        embeddings, boxes, timings = pipeline.process(image)
+    except pipeline.PipelineUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start = time.perf_counter()
+    response = mark_faces(int(course_id), embeddings)
+    timings["match_ms"] = (time.perf_counter() - start) * 1000
+
+    for result, box in zip(response["results"], boxes.tolist()):
+        result["box"] = box
+    response["faces_detected"] = len(boxes)
+    response["timings"] = {stage: round(ms, 2) for stage, ms in timings.items()}
+    return jsonify(response)
+
+
+# -------------------------------
+# Live Sessions
+# -------------------------------
+@attendance_bp.route("/sessions", methods=["POST"])
+@token_required
+def open_session():
+    data = request.get_json(silent=True) or {}
+    course_id = _course_id(data.get("course_id"))
+    if course_id is None:
+        return jsonify({"error": "course_id must be an integer"}), 400
+
+    conn = get_db()
+    if not conn.execute("SELECT 1 FROM courses WHERE id=?", (course_id,)).fetchone():
+        return jsonify({"error": "Course not found"}), 404
+    session = sessions.open_session(conn, course_id, g.user.get("user_id"))
+    return jsonify({"open": True, **session})
+
+
+@attendance_bp.route("/sessions/<int:course_id>", methods=["GET"])
+@token_required
+def session_status(course_id):
+    """Whether a session is open, and how this worker's layers absorbed its frames"""
+    live = sessions.get(get_db().cursor(), course_id)
+    if live is None:
+        return jsonify({"course_id": course_id, "open": False})
+    return jsonify({
+        "course_id": course_id,
+        "open": True,
+        "opened_at": live.opened_at,
+        "marked": len(live.marked),
+        "stats": dict(live.stats),
+    })
+
+
+@attendance_bp.route("/sessions/<int:course_id>", methods=["DELETE"])
+@token_required
+def close_session(course_id):
+    stats = sessions.close_session(get_db(), course_id)
+    if stats is None:
+        return jsonify({"error": "No open session for this course"}), 404
+    return jsonify({"course_id": course_id, "open": False, "stats": stats})
+
+
+# -------------------------------
+# Attendance Export (registrars)
+# -------------------------------
+@attendance_bp.route("/export", methods=["GET"])
+@token_required
+def export_attendance():
+    """
+    Stream attendance rows with student and course details as
+    ?format=csv|arrow|parquet, optionally filtered by ?from=, ?to=
+    (session dates, YYYY-MM-DD) and ?course_id=
+    """
+    if g.user.get("role") not in ["hod", "admin"]:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    fmt = request.args.get("format", "csv")
+    course_id = request.args.get("course_id")
+    if course_id is not None and not course_id.isdigit():
+        return jsonify({"error": "course_id must be an integer"}), 400
+    try:
+        stream = export.export(get_db(), fmt, request.args.get("from"), request.args.get("to"), course_id)
+    except export.ExportUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filename = f"attendance.{export.EXTENSIONS[fmt]}"
+    return Response(stream_with_context(stream), mimetype=export.MIMETYPES[fmt],
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
 # -------------------------------
 # Course Attendance Tiers (Analytics)
 # -------------------------------
 @attendance_bp.route("/course_attendance_tiers/<int:course_id>", methods=["GET"])
 @token_required
 def course_attendance_tiers(course_id):
-    conn = sqlite3.connect("attendance.db")
+    conn = get_db()
     cursor = conn.cursor()
 
     # Count total sessions held for this course
-    cursor.execute("SELECT COUNT(DISTINCT DATE(timestamp)) FROM attendance WHERE course_id=?", (course_id,))
+    cursor.execute("SELECT COUNT(*) FROM course_sessions WHERE course_id=?", (course_id,))
     total_sessions = cursor.fetchone()[0]
 
     if total_sessions == 0:
-        conn.close()
         return jsonify({"message": "No attendance records yet"}), 200
 
-    # Get student attendance
+    # Get student attendance (maintained per student and course by triggers)
     cursor.execute("""
-        SELECT s.id, s.first_name, s.last_name, s.matric_number, COUNT(a.id) as attended
-        FROM students s
-        JOIN student_courses sc ON s.id = sc.student_id
-        LEFT JOIN attendance a ON s.id = a.student_id AND a.course_id=sc.course_id
+        SELECT s.id, s.first_name, s.last_name, s.matric_number, COALESCE(sca.attended, 0) as attended
+        FROM student_courses sc
+        JOIN students s ON s.id = sc.student_id
+        LEFT JOIN student_course_attendance sca
+               ON sca.student_id = sc.student_id AND sca.course_id = sc.course_id
         WHERE sc.course_id=?
-        GROUP BY s.id
+        ORDER BY sc.student_id
     """, (course_id,))
 
-    records = cursor.fetchall()
-    conn.close()
-
-    attendance_data = []
-    for student_id, first_name, last_name, matric_number, attended in records:
+    # Categorize into tiers in one pass
+    tiers = {"25%_or_below": [], "50%_or_below": [], "75%_or_below": [], "100%": []}
+    for student_id, first_name, last_name, matric_number, attended in cursor.fetchall():
         percentage = (attended / total_sessions) * 100
-        attendance_data.append({
+        if percentage <= 25:
+            tier = "25%_or_below"
+        elif percentage <= 50:
+            tier = "50%_or_below"
+        elif percentage <= 75:
+            tier = "75%_or_below"
+        else:
+            tier = "100%"
+        tiers[tier].append({
             "student_id": student_id,
             "name": f"{first_name} {last_name}",
             "matric_number": matric_number,
@@ -151,14 +463,6 @@ def course_attendance_tiers(course_id):
             "percentage": percentage
         })
 
-    # Categorize into tiers
-    tiers = {
-        "25%_or_below": [s for s in attendance_data if s["percentage"] <= 25],
-        "50%_or_below": [s for s in attendance_data if 25 < s["percentage"] <= 50],
-        "75%_or_below": [s for s in attendance_data if 50 < s["percentage"] <= 75],
-        "100%": [s for s in attendance_data if s["percentage"] > 75],
-    }
-
     return jsonify({
         "course_id": course_id,
         "total_sessions": total_sessions,
@@ -172,53 +476,41 @@ def course_attendance_tiers(course_id):
 @attendance_bp.route("/department_summary", methods=["GET"])
 @token_required
 def department_summary():
-    conn = sqlite3.connect("attendance.db")
-    cursor = conn.cursor()
-
-    # Total courses
-    cursor.execute("SELECT COUNT(*) FROM courses")
-    total_courses = cursor.fetchone()[0]
-
-    # Total students
-    cursor.execute("SELECT COUNT(*) FROM students")
-    total_students = cursor.fetchone()[0]
-
-    # Total attendance records
-    cursor.execute("SELECT COUNT(*) FROM attendance")
-    total_attendance = cursor.fetchone()[0]
-
-    # Course-level stats
-    cursor.execute("""
-        SELECT c.id, c.name, COUNT(DISTINCT DATE(a.timestamp)) as sessions, COUNT(a.id) as attendance_records
-        FROM courses c
-        LEFT JOIN attendance a ON c.id = a.course_id
-        GROUP BY c.id
-    """)
-    course_stats = [
-        {"course_id": row[0], "course_name": row[1], "sessions": row[2], "attendance_records": row[3]}
-        for row in cursor.fetchall()
-    ]
-
-    # Student-level stats
-    cursor.execute("""
-        SELECT s.id, s.first_name, s.last_name, s.matric_number, COUNT(a.id) as total_attended
-        FROM students s
-        LEFT JOIN attendance a ON s.id = a.student_id
-        GROUP BY s.id
-    """)
-    student_stats = [
-        {"student_id": row[0], "name": f"{row[1]} {row[2]}", "matric_number": row[3], "total_attended": row[4]}
-        for row in cursor.fetchall()
-    ]
-
-    conn.close()
-
-    return jsonify({
-        "summary": {
-            "total_courses": total_courses,
-            "total_students": total_students,
-            "total_attendance_records": total_attendance,
-        },
-        "course_stats": course_stats,
-        "student_stats": student_stats
-    })
+    """
+    ?limit=N pages student_stats by student id; pass the returned
+    next_after as ?after= for the next page. ?format=ndjson streams one
+    JSON object per line instead: the summary, then each course (first
+    page only), then each student, so large departments never sit in
+    memory at once.
+    """
+    try:
+        after = int(request.args.get("after", 0))
+        limit = request.args.get("limit")
+        limit = None if limit is None else min(int(limit), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "after and limit must be integers"}), 400
+    if limit is not None and limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    conn = get_db()
+    if request.args.get("format") == "ndjson":
+        def lines():
+            yield json.dumps({"summary": analytics.department_totals(conn)}) + "\n"
+            if after == 0:
+                for course in analytics.course_stats(conn):
+                    yield json.dumps({"course": course}) + "\n"
+            for student in analytics.student_stats(conn, after, limit):
+                yield json.dumps({"student": student}) + "\n"
+
+        return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
+    student_stats = list(analytics.student_stats(conn, after, limit))
+    response = {
+        "summary": analytics.department_totals(conn),
+        "course_stats": list(analytics.course_stats(conn)),
+        "student_stats": student_stats,
+    }
+    if limit is not None:
+        full = len(student_stats) == limit
+        response["next_after"] = student_stats[-1]["student_id"] if full else None
+    return jsonify(response)
@@ -3,8 +3,13 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from db import get_db
 import jwt
 import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 import os
+import cache
 
 auth_bp = Blueprint("auth", __name__)
 
@@ -14,6 +19,12 @@ auth_bp = Blueprint("auth", __name__)
 JWT_SECRET = os.getenv("JWT_SECRET", "supersecretkey")  # ⚠️ use env var in prod
 JWT_ALGO = "HS256"
 JWT_EXP_HOURS = 6
+# Verified tokens remembered per worker, so a camera re-sending the same
+# token several times a second skips the HMAC check and JSON parsing; 0 disables
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+
+_token_lock = threading.Lock()
+_verified = OrderedDict()  # sha256(token) -> (payload, exp), least recently used first
 
 
 def create_token(user_id, role):
@@ -36,6 +47,34 @@ def decode_token(token):
         return {"error": "Invalid token"}
 
 
+def verify_token(token):
+    """
+    decode_token() with a bounded LRU of tokens that already verified.
+    A cached token is only reused until its exp; failures are not cached.
+    """
+    if TOKEN_CACHE_SIZE <= 0:
+        return decode_token(token)
+    key = hashlib.sha256(token.encode()).digest()
+    with _token_lock:
+        entry = _verified.get(key)
+        if entry is not None:
+            if entry[1] > time.time():
+                _verified.move_to_end(key)
+                cache.stats["auth.token:hit"] += 1
+                return dict(entry[0])
+            del _verified[key]
+    cache.stats["auth.token:miss"] += 1
+
+    decoded = decode_token(token)
+    if "error" not in decoded and "exp" in decoded:
+        with _token_lock:
+            _verified[key] = (decoded, decoded["exp"])
+            if len(_verified) > TOKEN_CACHE_SIZE:
+                _verified.popitem(last=False)
+        decoded = dict(decoded)
+    return decoded
+
+
 def token_required(func):
     """Decorator to protect endpoints with JWT"""
     @wraps(func)
@@ -45,7 +84,7 @@ def token_required(func):
             return jsonify({"error": "Token required"}), 401
 
         token = auth_header.split(" ")[1]
-        decoded = decode_token(token)
+        decoded = verify_token(token)
 
         if isinstance(decoded, dict) and "error" in decoded:
             return jsonify(decoded), 401  # return specific error
@@ -76,11 +115,11 @@ def register():
             (username, generate_password_hash(password), "lecturer")
         )
         conn.commit()
+        cache.invalidate("lecturers")
         return jsonify({"message": "Lecturer registered successfully"})
     except Exception as e:
+        conn.rollback()
         return jsonify({"error": "Username already exists"}), 400
-    finally:
-        conn.close()
 
 
 # -------------------------------
@@ -96,7 +135,6 @@ def login():
     cursor = conn.cursor()
     cursor.execute("SELECT id, password, role FROM lecturers WHERE username=?", (username,))
     lecturer = cursor.fetchone()
-    conn.close()
 
     if lecturer and check_password_hash(lecturer[1], password):
         token = create_token(lecturer[0], lecturer[2])
@@ -0,0 +1,141 @@
+"""
+Times the HOD dashboard queries on a synthetic department, before and
+after pre-aggregating each side of the join (analytics.py), and checks
+the new per-course averages against a count over the raw attendance rows.
+
+    python benchmarks/bench_analytics.py [students] [courses] [attendance_rows] [budget_s]
+
+Defaults to 5000 students, 200 courses and 1M attendance rows. The old
+courses query multiplies enrollments by attendance rows, so each old
+query is abandoned after budget_s seconds (default 60).
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+workdir = tempfile.mkdtemp()
+os.environ["ATTENDANCE_DB"] = os.path.join(workdir, "analytics.db")
+import analytics  # noqa: E402
+import db  # noqa: E402
+
+COURSES_PER_STUDENT = 6
+
+# The queries hod.py ran before analytics.py
+OLD_COURSES_SUMMARY = """
+    SELECT c.id as course_id, c.name, l.username as lecturer,
+           COUNT(sc.student_id) as student_count,
+           COALESCE(ROUND(
+               (CAST(COUNT(a.id) AS FLOAT) / NULLIF(COUNT(sc.student_id),0)) * 100, 2
+           ), 0) as average_attendance
+    FROM courses c
+    LEFT JOIN lecturers l ON c.lecturer_id = l.id
+    LEFT JOIN student_courses sc ON c.id = sc.course_id
+    LEFT JOIN attendance a ON c.id = a.course_id
+    GROUP BY c.id
+"""
+OLD_LOW_ATTENDANCE = """
+    SELECT s.id as student_id, s.first_name || ' ' || s.last_name as name,
+           s.matric_number,
+           COUNT(a.id) as attended_sessions,
+           (COUNT(a.id) * 100.0 / NULLIF((SELECT COUNT(*) FROM courses c
+                                         JOIN student_courses sc ON sc.course_id=c.id
+                                         WHERE sc.student_id=s.id),0)) as percentage
+    FROM students s
+    LEFT JOIN attendance a ON s.id = a.student_id
+    GROUP BY s.id
+    HAVING percentage <= 25
+"""
+
+
+def populate(conn, students, courses, rows, rng):
+    conn.executemany("INSERT INTO students (first_name, last_name, matric_number, level, name) VALUES (?, ?, ?, ?, ?)",
+                     [("S", str(i), f"M{i:06d}", "100", f"S {i}") for i in range(students)])
+    conn.executemany("INSERT INTO courses (name, lecturer_id) VALUES (?, NULL)",
+                     [(f"C{i:04d}",) for i in range(courses)])
+    enrolled = {}
+    for student in range(1, students + 1):
+        for course in rng.sample(range(1, courses + 1), min(COURSES_PER_STUDENT, courses)):
+            enrolled.setdefault(course, []).append(student)
+    conn.executemany("INSERT INTO student_courses (student_id, course_id) VALUES (?, ?)",
+                     [(s, c) for c, members in enrolled.items() for s in members])
+
+    # Enough sessions per course to reach `rows` with most students present;
+    # each student gets a personal attendance rate so some fall below 25%
+    enrollments = sum(len(m) for m in enrolled.values())
+    sessions = max(1, round(rows / (enrollments * 0.8)))
+    rate = {s: rng.uniform(0.05, 0.3) if rng.random() < 0.05 else rng.betavariate(5, 1.2)
+            for s in range(1, students + 1)}
+    first = date(2026, 1, 5)
+
+    def marks():
+        made = 0
+        for course, members in enrolled.items():
+            for day in range(sessions):
+                session = (first + timedelta(days=day)).isoformat()
+                for student in members:
+                    if made < rows and rng.random() < rate[student]:
+                        made += 1
+                        yield student, course, f"{session} 09:00:00", session
+
+    conn.executemany(db.INSERT_ATTENDANCE, marks())
+    conn.commit()
+
+
+def timed(conn, label, run, budget):
+    deadline = time.perf_counter() + budget
+    conn.set_progress_handler(lambda: time.perf_counter() > deadline, 100000)
+    start = time.perf_counter()
+    try:
+        result = run()
+    except db.sqlite3.OperationalError:  # interrupted by the progress handler
+        print(f"{label:<28} > {budget:.0f} s (abandoned)")
+        return None
+    finally:
+        conn.set_progress_handler(None, 0)
+    print(f"{label:<28} {(time.perf_counter() - start) * 1000:10.1f} ms  {len(result)} rows")
+    return result
+
+
+def expected_averages(conn):
+    """Per-course average straight from the raw rows"""
+    enrolled = dict(conn.execute("SELECT course_id, COUNT(*) FROM student_courses GROUP BY course_id"))
+    held = {}
+    for course_id, sessions, records in conn.execute(
+            "SELECT course_id, COUNT(DISTINCT session_date), COUNT(*) FROM attendance GROUP BY course_id"):
+        held[course_id] = round(records * 100.0 / (enrolled[course_id] * sessions), 2)
+    return held
+
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    courses = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rows = int(sys.argv[3]) if len(sys.argv) > 3 else 1_000_000
+    budget = float(sys.argv[4]) if len(sys.argv) > 4 else 60
+
+    db.init_db()
+    conn = db.connect()
+    start = time.perf_counter()
+    populate(conn, students, courses, rows, random.Random(0))
+    count = conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+    print(f"{students} students, {courses} courses, {count} attendance rows "
+          f"(built in {time.perf_counter() - start:.1f} s)\n")
+
+    timed(conn, "courses_summary  before", lambda: conn.execute(OLD_COURSES_SUMMARY).fetchall(), budget)
+    summary = timed(conn, "courses_summary  after", lambda: analytics.courses_summary(conn), budget)
+    timed(conn, "low_attendance   before", lambda: conn.execute(OLD_LOW_ATTENDANCE).fetchall(), budget)
+    low = timed(conn, "low_attendance   after", lambda: analytics.low_attendance(conn), budget)
+
+    expected = expected_averages(conn)
+    wrong = [r["course_id"] for r in summary if r["average_attendance"] != expected.get(r["course_id"], 0)]
+    print(f"\ncourse averages match raw rows: {'yes' if not wrong else f'no, courses {wrong[:10]}'}")
+    print(f"students at or below {analytics.LOW_ATTENDANCE_PERCENT}%: {len(low)}")
+    conn.close()
+    sys.exit(1 if wrong else 0)
+
+
+if __name__ == "__main__":
+    main()
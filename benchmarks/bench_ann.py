@@ -0,0 +1,54 @@
+"""
+Recall and latency of the IVF index (ivf.py) against the exact scan, to
+pick MATCHER_MODE / IVF_NPROBE for a given gallery size.
+
+    python benchmarks/bench_ann.py [faces]
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gallery import EMBEDDING_DIM, nearest_rows  # noqa: E402
+from ivf import IVFIndex  # noqa: E402
+
+QUERIES = 500
+
+
+def synthetic_gallery(rng, n):
+    # Face embeddings cluster by demographics/pose; mimic that with blobs
+    centres = rng.normal(scale=0.09, size=(max(1, n // 200), EMBEDDING_DIM))
+    gallery = centres[rng.integers(len(centres), size=n)]
+    gallery += rng.normal(scale=0.05, size=(n, EMBEDDING_DIM))
+    return np.ascontiguousarray(gallery, dtype=np.float32)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = np.random.default_rng(0)
+    gallery = synthetic_gallery(rng, n)
+    sq_norms = np.einsum("ij,ij->i", gallery, gallery)
+    targets = rng.integers(n, size=QUERIES)
+    queries = gallery[targets] + rng.normal(scale=0.02, size=(QUERIES, EMBEDDING_DIM)).astype(np.float32)
+
+    start = time.perf_counter()
+    index = IVFIndex.train(gallery)
+    print(f"{n} faces, {len(index.centroids)} lists, trained in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    exact = np.array([nearest_rows(gallery, sq_norms, q)[0][0] for q in queries])
+    exact_ms = (time.perf_counter() - start) / QUERIES * 1000
+    print(f"{'mode':>10} {'recall@1':>9} {'ms/query':>9}")
+    print(f"{'exact':>10} {1.0:>9.3f} {exact_ms:>9.3f}")
+
+    for nprobe in (1, 4, 8, 16, 32):
+        start = time.perf_counter()
+        found = np.array([index.search(gallery, sq_norms, q, nprobe)[0][0] for q in queries])
+        ivf_ms = (time.perf_counter() - start) / QUERIES * 1000
+        recall = np.mean(found == exact)
+        print(f"{'ivf/' + str(nprobe):>10} {recall:>9.3f} {ivf_ms:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
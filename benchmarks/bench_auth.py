@@ -0,0 +1,54 @@
+"""
+Per-request cost of @token_required on a view that does nothing, with
+and without the verified-token cache, for a camera re-sending one token
+and for many distinct tokens cycling through a cache that is too small.
+
+    python benchmarks/bench_auth.py [requests]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from flask import Flask  # noqa: E402
+import auth  # noqa: E402
+import cache  # noqa: E402
+
+app = Flask(__name__)
+
+
+@auth.token_required
+def noop():
+    return "ok"
+
+
+def per_request_us(tokens, requests):
+    headers = [{"Authorization": f"Bearer {token}"} for token in tokens]
+    contexts = [app.test_request_context("/", headers=h) for h in headers]
+    start = time.perf_counter()
+    for i in range(requests):
+        with contexts[i % len(contexts)]:
+            noop()
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    one = [auth.create_token(1, "lecturer")]
+    many = [auth.create_token(i, "lecturer") for i in range(2 * auth.TOKEN_CACHE_SIZE)]
+    size = auth.TOKEN_CACHE_SIZE
+
+    for label, tokens in (("same token", one), (f"{len(many)} tokens", many)):
+        auth.TOKEN_CACHE_SIZE = 0
+        uncached = per_request_us(tokens, requests)
+        auth.TOKEN_CACHE_SIZE = size
+        auth._verified.clear()
+        cache.stats.clear()
+        cached = per_request_us(tokens, requests)
+        hits, misses = cache.stats["auth.token:hit"], cache.stats["auth.token:miss"]
+        print(f"{label:<14} uncached {uncached:6.1f} us   cached {cached:6.1f} us   "
+              f"hit rate {hits / max(1, hits + misses):.1%}")
+
+
+if __name__ == "__main__":
+    main()
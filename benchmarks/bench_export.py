@@ -0,0 +1,77 @@
+"""
+Exports a synthetic 1M-row attendance table with export.py in every
+available format and reports time, file size and the exporting process's
+peak RSS, chunked (EXPORT_CHUNK_ROWS) versus everything in one chunk.
+
+    python benchmarks/bench_export.py [attendance_rows]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+workdir = tempfile.mkdtemp()
+os.environ["ATTENDANCE_DB"] = os.path.join(workdir, "export.db")
+import db  # noqa: E402
+import export  # noqa: E402
+
+STUDENTS, COURSES = 5000, 200
+
+
+def populate(conn, rows):
+    conn.executemany("INSERT INTO students (first_name, last_name, matric_number, level, name) VALUES (?, ?, ?, ?, ?)",
+                     [("S", str(i), f"M{i:06d}", "100", f"S {i}") for i in range(STUDENTS)])
+    conn.executemany("INSERT INTO courses (name, lecturer_id) VALUES (?, NULL)",
+                     [(f"C{i:04d}",) for i in range(COURSES)])
+    first = date(2026, 1, 5)
+
+    def marks():
+        for i in range(rows):
+            # every (course, student, day) distinct: walk students, then courses, then days
+            student, rest = i % STUDENTS, i // STUDENTS
+            course, day = rest % COURSES, rest // COURSES
+            session = (first + timedelta(days=day)).isoformat()
+            yield student + 1, course + 1, f"{session} 09:00:00", session
+
+    conn.executemany(db.INSERT_ATTENDANCE, marks())
+    conn.commit()
+
+
+def run(fmt, chunk_rows):
+    path = os.path.join(workdir, f"attendance.{export.EXTENSIONS[fmt]}")
+    env = dict(os.environ, EXPORT_CHUNK_ROWS=str(chunk_rows))
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "export.py"), path, "--format", fmt],
+                            env=env, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status:
+        raise SystemExit(f"export to {fmt} failed")
+    # ru_maxrss is in KiB on Linux
+    return elapsed, os.path.getsize(path), usage.ru_maxrss / 1024
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    db.init_db()
+    conn = db.connect()
+    populate(conn, rows)
+    conn.close()
+    print(f"{rows} attendance rows\n")
+
+    formats = ["csv"] + (["arrow", "parquet"] if export.pa is not None else [])
+    if export.pa is None:
+        print("pyarrow not installed: CSV only\n")
+    print(f"{'format':<9}{'chunking':<14}{'time':>9}{'rows/s':>12}{'size':>11}{'peak RSS':>11}")
+    for fmt in formats:
+        for label, chunk_rows in ((f"{export.CHUNK_ROWS} rows", export.CHUNK_ROWS), ("one chunk", rows + 1)):
+            elapsed, size, rss = run(fmt, chunk_rows)
+            print(f"{fmt:<9}{label:<14}{elapsed:8.2f}s{rows / elapsed:12.0f}{size / 2**20:9.1f}MB{rss:9.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
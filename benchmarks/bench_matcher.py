@@ -0,0 +1,54 @@
+"""
+Micro-benchmark for find_best_match: the original per-request
+np.linalg.norm(gallery - query) scan versus the float32 GEMM matcher.
+
+    python benchmarks/bench_matcher.py
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from gallery import EMBEDDING_DIM, nearest_rows  # noqa: E402
+
+REPEATS = 200
+
+
+def legacy_match(gallery, query):
+    distances = np.linalg.norm(gallery - query, axis=1)
+    index = np.argmin(distances)
+    return index, distances[index]
+
+
+def gemm_match(gallery, sq_norms, query):
+    indices, sq_distances = nearest_rows(gallery, sq_norms, query)
+    return indices[0], np.sqrt(sq_distances[0])
+
+
+def timed(fn, *args):
+    fn(*args)
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        fn(*args)
+    return (time.perf_counter() - start) / REPEATS * 1000
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f"{'faces':>8} {'legacy ms':>10} {'gemm ms':>10} {'speedup':>8}")
+    for n in (1_000, 10_000, 100_000):
+        gallery64 = rng.normal(scale=0.09, size=(n, EMBEDDING_DIM))
+        gallery32 = np.ascontiguousarray(gallery64, dtype=np.float32)
+        sq_norms = np.einsum("ij,ij->i", gallery32, gallery32)
+        query = gallery64[n // 2] + rng.normal(scale=0.01, size=EMBEDDING_DIM)
+
+        assert legacy_match(gallery64, query)[0] == gemm_match(gallery32, sq_norms, query)[0]
+
+        legacy = timed(legacy_match, gallery64, query)
+        gemm = timed(gemm_match, gallery32, sq_norms, query)
+        print(f"{n:>8} {legacy:>10.3f} {gemm:>10.3f} {legacy / gemm:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
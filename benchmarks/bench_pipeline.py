@@ -0,0 +1,73 @@
+"""
+Per-stage timings and throughput of the server-side face pipeline
+(pipeline.py) running on the recognition process pool (recognition.py) on synthetic classroom photos, using a small stand-in model
+so no detector/embedder weights, network or GPU are needed.
+
+    python benchmarks/bench_pipeline.py [requests] [concurrency]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import pipeline  # noqa: E402
+import recognition  # noqa: E402
+from gallery import EMBEDDING_DIM  # noqa: E402
+
+FACES_PER_PHOTO = 12
+
+
+class StandInModel:
+    """Fixed grid of 'faces'; each embedding is the crop shrunk to 128 grey pixels"""
+
+    def detect(self, image):
+        height, width = image.shape[:2]
+        cols = 4
+        rows = FACES_PER_PHOTO // cols
+        w, h = width // cols, height // rows
+        return np.array([(c * w, r * h, (c + 1) * w, (r + 1) * h)
+                         for r in range(rows) for c in range(cols)])
+
+    def embed(self, image, boxes):
+        grey = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        crops = [cv2.resize(grey[y1:y2, x1:x2], (16, 8)) for x1, y1, x2, y2 in boxes]
+        return np.array(crops, dtype=np.float32).reshape(-1, EMBEDDING_DIM) / 255
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    pipeline.set_model_factory(StandInModel)
+
+    rng = np.random.default_rng(0)
+    photo = rng.integers(0, 255, size=(1080, 1920, 3), dtype=np.uint8)
+    jpeg = cv2.imencode(".jpg", photo)[1].tobytes()
+
+    def client(_):
+        try:
+            return pipeline.process(jpeg)
+        except recognition.Overloaded:
+            return None  # what the endpoint turns into 503 + Retry-After
+
+    pipeline.process(jpeg)  # start the workers and load their models
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as clients:
+        outcomes = list(clients.map(client, range(requests)))
+    elapsed = time.perf_counter() - start
+    results = [outcome for outcome in outcomes if outcome is not None]
+
+    print(f"{requests} photos ({len(jpeg) // 1024} KiB, {FACES_PER_PHOTO} faces), "
+          f"{concurrency} clients, {recognition.WORKERS} pool workers")
+    print(f"throughput: {len(results) / elapsed:.1f} photos/s, "
+          f"{requests - len(results)} rejected (queue limit {recognition.MAX_PENDING})")
+    for stage in results[0][2]:
+        times = np.array([timings[stage] for _, _, timings in results])
+        print(f"{stage:>10}: median {np.median(times):7.2f} ms  p95 {np.percentile(times, 95):7.2f} ms")
+    recognition.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Memory and latency of the gallery scan in float32 versus the quantized
+float16 / int8 scan with float32 re-ranking (GALLERY_SCAN_DTYPE), and
+whether any query's match or 0.6-threshold decision changes.
+
+Each mode loads the same on-disk gallery in a fresh process and reports
+its anonymous (private) resident memory, which is what every gunicorn
+worker pays; the mapped base file is file-backed page cache shared by
+all workers. Each mode is compacted first, as in production, so the
+quantized scan codes are mapped from the file compact() writes rather than
+encoded by the measured process.
+
+    python benchmarks/bench_quantized.py [faces] [queries]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import numpy as np  # noqa: E402
+
+THRESHOLD = 0.6
+MODES = ("float32", "float16", "int8")
+
+
+def rss_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def worker(queries_path, batch):
+    """Runs in a child process with GALLERY_SCAN_DTYPE set"""
+    import gallery
+
+    queries = np.load(queries_path)
+    before = rss_kb("RssAnon")
+    gallery.get_gallery()
+    loaded = rss_kb("RssAnon")
+    gallery.nearest_many(queries[:batch])  # warm up
+    start = time.perf_counter()
+    matches = []
+    for i in range(0, len(queries), batch):
+        matches += gallery.nearest_many(queries[i:i + batch])
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "gallery_mb": (loaded - before) / 1024,
+        "peak_anon_mb": rss_kb("RssAnon") / 1024,
+        "file_mb": rss_kb("RssFile") / 1024,
+        "us_per_query": elapsed / len(queries) * 1e6,
+        "matches": [[str(name), distance] for name, distance in matches],
+    }))
+
+
+def main():
+    faces = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    workdir = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+
+    def unit(x):
+        return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+    embeddings = unit(rng.normal(size=(faces, 128)))
+    np.save(os.path.join(workdir, "embeddings.npy"), embeddings)
+    np.save(os.path.join(workdir, "names.npy"), np.array([f"M{i:07d}" for i in range(faces)]))
+    # Half the queries are noisy captures of enrolled faces, half strangers
+    known = embeddings[rng.integers(0, faces, count // 2)]
+    queries = np.concatenate([unit(known + rng.normal(0, 0.04, known.shape)),
+                              unit(rng.normal(size=(count - len(known), 128)))])
+    queries_path = os.path.join(workdir, "queries.npy")
+    np.save(queries_path, queries)
+    del embeddings
+
+    env = dict(os.environ, PYTHONPATH=ROOT,
+               EMBEDDINGS_FILE=os.path.join(workdir, "embeddings.npy"),
+               NAMES_FILE=os.path.join(workdir, "names.npy"),
+               GALLERY_LOG_FILE=os.path.join(workdir, "gallery.log"))
+    results = {}
+    for mode in MODES:
+        subprocess.run([sys.executable, __file__, "--compact"],
+                       env=dict(env, GALLERY_SCAN_DTYPE=mode), check=True)
+        out = subprocess.run([sys.executable, __file__, "--worker", queries_path, "16"],
+                             env=dict(env, GALLERY_SCAN_DTYPE=mode), capture_output=True, text=True, check=True)
+        results[mode] = json.loads(out.stdout)
+
+    reference = results["float32"]["matches"]
+    print(f"{faces} faces, {count} queries in batches of 16\n")
+    print(f"{'scan':<9}{'gallery':>10}{'peak anon':>11}{'file-backed':>13}{'per query':>12}"
+          f"{'same match':>12}{'same decision':>15}")
+    for mode in MODES:
+        r = results[mode]
+        same = sum(a[0] == b[0] for a, b in zip(r["matches"], reference))
+        decided = sum((a[1] <= THRESHOLD) == (b[1] <= THRESHOLD) and (a[1] > THRESHOLD or a[0] == b[0])
+                      for a, b in zip(r["matches"], reference))
+        print(f"{mode:<9}{r['gallery_mb']:8.1f}MB{r['peak_anon_mb']:9.1f}MB{r['file_mb']:11.1f}MB"
+              f"{r['us_per_query']:10.1f}us{same:>8}/{count}{decided:>11}/{count}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        worker(sys.argv[2], int(sys.argv[3]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "--compact":
+        import gallery
+        gallery.compact()
+    else:
+        main()
@@ -0,0 +1,80 @@
+"""
+Simulates a classroom camera posting frames to /attendance/mark_batch:
+the same students over and over, each face jittered a little per frame.
+Reports time per frame without and with a live session open, and how
+many faces each session layer absorbed.
+
+    python benchmarks/bench_sessions.py [frames] [gallery_size]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+workdir = tempfile.mkdtemp()
+os.environ.update(
+    ATTENDANCE_DB=os.path.join(workdir, "sessions.db"),
+    EMBEDDINGS_FILE=os.path.join(workdir, "embeddings.npy"),
+    NAMES_FILE=os.path.join(workdir, "names.npy"),
+    GALLERY_LOG_FILE=os.path.join(workdir, "gallery.log"),
+    CACHE_STAMP_DIR=os.path.join(workdir, "cache_stamps"),
+)
+import numpy as np  # noqa: E402
+import enrollment  # noqa: E402
+from app import app  # noqa: E402
+from auth import create_token  # noqa: E402
+from db import connect  # noqa: E402
+
+CLASS_SIZE, FACES_PER_FRAME, JITTER = 60, 25, 0.003
+
+
+def camera(rng, faces, frames):
+    for _ in range(frames):
+        present = rng.choice(CLASS_SIZE, FACES_PER_FRAME, replace=False)
+        yield (faces[present] + rng.normal(0, JITTER, (FACES_PER_FRAME, faces.shape[1]))).astype(np.float32)
+
+
+def run(client, headers, course_id, frames):
+    start = time.perf_counter()
+    for frame in frames:
+        response = client.post("/attendance/mark_batch", headers=headers,
+                               json={"course_id": course_id, "embeddings": frame.tolist()})
+        assert response.status_code == 200, response.get_json()
+    return time.perf_counter() - start
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    gallery_size = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    rng = np.random.default_rng(0)
+    faces = rng.normal(0, 0.1, (gallery_size, 128)).astype(np.float32)
+
+    conn = connect()
+    enrollment.import_students(conn, (
+        {"first_name": "S", "last_name": str(i), "matric_number": f"M{i:06d}", "level": "100",
+         # the first class is the one being filmed; the second is filmed with a session open
+         "courses_offered": ["CAM101", "CAM102"] if i < CLASS_SIZE else ["OTHER"], "embedding": faces[i]}
+        for i in range(gallery_size)))
+    course_ids = dict(conn.execute("SELECT name, id FROM courses"))
+    conn.close()
+
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {create_token(1, 'lecturer')}"}
+
+    plain = run(client, headers, course_ids["CAM101"], camera(rng, faces, frames))
+    client.post("/attendance/sessions", headers=headers, json={"course_id": course_ids["CAM102"]})
+    live = run(client, headers, course_ids["CAM102"], camera(rng, faces, frames))
+    stats = client.delete(f"/attendance/sessions/{course_ids['CAM102']}", headers=headers).get_json()["stats"]
+
+    print(f"{frames} frames x {FACES_PER_FRAME} faces, gallery of {gallery_size}")
+    print(f"no session    {plain / frames * 1000:7.2f} ms/frame")
+    print(f"live session  {live / frames * 1000:7.2f} ms/frame")
+    print(f"\nfaces {stats.get('faces', 0)}: similarity cache {stats.get('similar', 0)}, "
+          f"gallery match {stats.get('matched', 0)}")
+    print(f"matched students: marked set {stats.get('already_marked', 0)}, "
+          f"sent to SQLite {stats.get('written', 0)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Throughput of whole-gallery matching in one process versus scattered to
+1, 2, 4 and 8 shard servers (shards.py), with several client threads
+standing in for gunicorn request threads. Also checks that the merged
+shard answers equal the single-process scan.
+
+Speed-up needs free cores: with fewer cores than shards the shards just
+take turns, and the numbers show the scatter-gather overhead instead.
+
+    python benchmarks/bench_shards.py [faces] [queries] [client_threads]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# Spawned shard processes re-run this module: keep the parent's directory
+if "BENCH_SHARDS_DIR" not in os.environ:
+    os.environ["BENCH_SHARDS_DIR"] = tempfile.mkdtemp()
+workdir = os.environ["BENCH_SHARDS_DIR"]
+os.environ.update(
+    EMBEDDINGS_FILE=os.path.join(workdir, "embeddings.npy"),
+    NAMES_FILE=os.path.join(workdir, "names.npy"),
+    GALLERY_LOG_FILE=os.path.join(workdir, "gallery.log"),
+)
+import numpy as np  # noqa: E402
+import gallery  # noqa: E402
+import shards  # noqa: E402
+
+BATCH = 16
+SHARD_COUNTS = (1, 2, 4, 8)
+
+
+def unit(x):
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def run(match, queries, threads):
+    """Queries per second with `threads` clients each matching batches of BATCH"""
+    batches = [queries[i:i + BATCH] for i in range(0, len(queries), BATCH)]
+    results = [None] * len(batches)
+    next_batch = iter(range(len(batches)))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                i = next(next_batch, None)
+            if i is None:
+                return
+            results[i] = match(batches[i])
+
+    workers = [threading.Thread(target=client) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return len(queries) / elapsed, [m for batch in results for m in batch]
+
+
+def wait_for_shards(timeout=60):
+    """Until every shard answers (each loads its slice before listening)"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            for conn in shards._connect():
+                conn.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def main():
+    faces = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    rng = np.random.default_rng(0)
+
+    embeddings = unit(rng.normal(size=(faces, gallery.EMBEDDING_DIM)))
+    np.save(os.environ["EMBEDDINGS_FILE"], embeddings)
+    np.save(os.environ["NAMES_FILE"], np.array([f"M{i:07d}" for i in range(faces)]))
+    known = embeddings[rng.integers(0, faces, count // 2)]
+    queries = np.concatenate([unit(known + rng.normal(0, 0.04, known.shape)),
+                              unit(rng.normal(size=(count - len(known), gallery.EMBEDDING_DIM)))])
+    del embeddings
+
+    print(f"{faces} faces, {count} queries in batches of {BATCH}, {threads} client threads, "
+          f"{os.cpu_count()} CPUs\n")
+    print(f"{'':<16}{'queries/s':>11}{'speed-up':>10}{'same answer':>14}")
+
+    gallery.get_gallery()
+    run(gallery.nearest_many, queries[:BATCH], 1)  # warm up
+    base_qps, reference = run(gallery.nearest_many, queries, threads)
+    print(f"{'one process':<16}{base_qps:11.0f}{1:9.2f}x{len(reference):>9}/{count}")
+
+    for count_shards in SHARD_COUNTS:
+        shards.SHARDS = count_shards
+        shards.SOCKET_DIR = os.path.join(workdir, f"sockets-{count_shards}")
+        processes = shards.start(count_shards)
+        try:
+            wait_for_shards()
+            run(shards.match, queries[:BATCH * threads], threads)  # connect every thread
+            qps, matches = run(shards.match, queries, threads)
+        finally:
+            for process in processes:
+                process.terminate()
+        same = sum(a[0] == b[0] and np.isclose(a[1], b[1]) for a, b in zip(matches, reference))
+        print(f"{f'{count_shards} shards':<16}{qps:11.0f}{qps / base_qps:9.2f}x{same:>9}/{count}")
+
+
+if __name__ == "__main__":
+    main()
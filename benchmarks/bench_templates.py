@@ -0,0 +1,96 @@
+"""
+Accuracy and latency of single-template matching (one exact scan over
+one face per student) versus several templates per student matched by
+centroid prefilter, template re-rank and top-k vote (gallery.TEMPLATE_MATCHING).
+The "uneven" rows enroll every other student with a single template, as
+in a gallery that predates multi-template registration, and ask only
+about those students: more templates must not outvote a closer face.
+
+Synthetic faces: each student is a unit vector, every capture of them
+(enrolled template or camera query) is that vector plus noise, with
+students drawn in look-alike groups so wrong matches are possible.
+
+    python benchmarks/bench_templates.py [students] [templates] [queries]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import numpy as np  # noqa: E402
+import gallery  # noqa: E402
+
+THRESHOLD = 0.6
+GROUP_SIZE, GROUP_SPREAD, CAPTURE_NOISE = 20, 0.35, 0.45
+
+
+def unit(x):
+    return (x / np.linalg.norm(x, axis=-1, keepdims=True)).astype(np.float32)
+
+
+def capture(rng, identities, count):
+    noise = rng.normal(0, CAPTURE_NOISE / np.sqrt(gallery.EMBEDDING_DIM), (count,) + identities.shape)
+    return unit(identities[None] + noise)
+
+
+def snapshot(embeddings, names, templates):
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    names = np.asarray(names, dtype=object)
+    sq_norms = np.einsum("ij,ij->i", embeddings, embeddings)
+    return gallery.Snapshot(embeddings, names, sq_norms, None,
+                            gallery._Templates(embeddings, names) if templates else None, None)
+
+
+def evaluate(label, snap, queries, truth, batch=32):
+    snap.templates and snap.templates.nearest_many(queries[:1])  # build centroids outside the timing
+    start = time.perf_counter()
+    matches = []
+    for i in range(0, len(queries), batch):
+        matches += gallery.nearest_many(queries[i:i + batch], snap)
+    elapsed = time.perf_counter() - start
+    names = np.array([n for n, _ in matches], dtype=object)
+    accepted = np.array([d <= THRESHOLD for _, d in matches])
+    right = (names == truth) & accepted
+    wrong = (names != truth) & accepted
+    print(f"{label:<34}{right.mean():9.1%}{wrong.mean():9.1%}{elapsed / len(queries) * 1e6:10.1f} us")
+
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    templates = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    queries = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    rng = np.random.default_rng(0)
+
+    groups = unit(rng.normal(size=(students // GROUP_SIZE + 1, gallery.EMBEDDING_DIM)))
+    spread = rng.normal(0, GROUP_SPREAD / np.sqrt(gallery.EMBEDDING_DIM), (students, gallery.EMBEDDING_DIM))
+    identities = unit(groups[np.arange(students) // GROUP_SIZE] + spread)
+    names = np.array([f"M{i:06d}" for i in range(students)], dtype=object)
+
+    enrolled = capture(rng, identities, templates)  # templates x students x 128
+    asked = rng.integers(0, students, queries)
+    probes = capture(rng, identities[asked], 1)[0]
+    truth = names[asked]
+
+    print(f"{students} students, {templates} templates each, {queries} queries, threshold {THRESHOLD}\n")
+    print(f"{'':<34}{'right':>9}{'wrong':>9}{'per query':>13}")
+    evaluate("single template, exact scan", snapshot(enrolled[0], names, False), probes, truth)
+    multi = enrolled.reshape(-1, gallery.EMBEDDING_DIM)
+    multi_names = np.tile(names, templates)
+    evaluate(f"{templates} templates, exact scan", snapshot(multi, multi_names, False), probes, truth)
+    for candidates in (4, 8, 32):
+        gallery.CENTROID_CANDIDATES = candidates
+        evaluate(f"{templates} templates, centroids top-{candidates}",
+                 snapshot(multi, multi_names, True), probes, truth)
+
+    # Odd students keep only their first template
+    keep = np.tile(np.arange(students) % 2 == 0, templates)
+    keep[:students] = True
+    single = asked % 2 == 1
+    uneven = snapshot(multi[keep], multi_names[keep], False), snapshot(multi[keep], multi_names[keep], True)
+    gallery.CENTROID_CANDIDATES = 8
+    evaluate("uneven, exact scan", uneven[0], probes[single], truth[single])
+    evaluate("uneven, centroids top-8", uneven[1], probes[single], truth[single])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Parse cost per request of the embedding wire formats accepted by
+/attendance/mark, /attendance/mark_batch and /students/register (wire.py):
+JSON float lists versus base64 JSON, msgpack bin and raw octet-stream.
+
+    python benchmarks/bench_wire.py [faces_per_request]
+"""
+import base64
+import json
+import os
+import sys
+import time
+import numpy as np
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import wire  # noqa: E402
+from gallery import EMBEDDING_DIM  # noqa: E402
+
+REPEATS = 2000
+
+
+def payloads(embeddings):
+    raw = embeddings.astype("<f4").tobytes()
+    formats = {
+        "json": ("application/json", json.dumps({"course_id": 1, "embeddings": embeddings.tolist()})),
+        "json+base64": ("application/json",
+                        json.dumps({"course_id": 1, "embeddings": base64.b64encode(raw).decode()})),
+        "octet-stream": ("application/octet-stream", raw),
+    }
+    if wire.msgpack is not None:
+        formats["msgpack"] = ("application/msgpack", wire.msgpack.packb({"course_id": 1, "embeddings": raw}))
+    return formats
+
+
+def main():
+    faces = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(scale=0.1, size=(faces, EMBEDDING_DIM)).astype(np.float32)
+    app = Flask(__name__)
+
+    print(f"{faces} embedding(s) per request, {REPEATS} requests")
+    print(f"{'format':>14} {'bytes':>8} {'us/request':>11}")
+
+    # Fixed cost of building the request context, included in every row below
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        with app.test_request_context("/mark_batch?course_id=1", method="POST",
+                                      data=b"", content_type="application/octet-stream"):
+            pass
+    print(f"{'(no parsing)':>14} {0:>8} {(time.perf_counter() - start) / REPEATS * 1e6:>11.1f}")
+    for name, (content_type, body) in payloads(embeddings).items():
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            with app.test_request_context("/mark_batch?course_id=1", method="POST",
+                                          data=body, content_type=content_type):
+                data, raw = wire.read_request()
+                matrix = wire.to_matrix(raw if raw is not None else data["embeddings"])
+        elapsed = (time.perf_counter() - start) / REPEATS * 1e6
+        assert np.array_equal(matrix, embeddings)
+        print(f"{name:>14} {len(body):>8} {elapsed:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Load test for the attendance write path: marks/second with one commit per
+mark versus the grouped write-behind queue (write_behind.py), with many
+request threads marking at once as in an exam-hall check-in burst.
+
+    python benchmarks/bench_write_behind.py [threads] [marks_per_thread]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+workdir = tempfile.mkdtemp()
+os.environ["ATTENDANCE_DB"] = os.path.join(workdir, "bench.db")
+os.environ["WRITE_BEHIND_DIR"] = os.path.join(workdir, "marks_log")
+import db  # noqa: E402
+import write_behind  # noqa: E402
+
+
+def direct(conn, rows):
+    for row in rows:
+        conn.execute(db.INSERT_ATTENDANCE, row)
+        conn.commit()
+
+
+def direct_full(conn, rows):
+    # Same durability promise as the write-behind log: fsync before replying
+    conn.execute("PRAGMA synchronous=FULL")
+    direct(conn, rows)
+
+
+def grouped(conn, rows):
+    cursor = conn.cursor()
+    for row in rows:
+        write_behind.submit(cursor, [row])
+
+
+def run(mark, threads, per_thread, course_id):
+    today = datetime.now()
+    timestamp, session_date = today.strftime("%Y-%m-%d %H:%M:%S"), today.strftime("%Y-%m-%d")
+
+    def worker(t):
+        conn = db.connect()
+        rows = [(t * per_thread + i, course_id, timestamp, session_date) for i in range(per_thread)]
+        mark(conn, rows)
+        conn.close()
+
+    pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return threads * per_thread / (time.perf_counter() - start)
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    db.init_db()
+
+    print(f"{threads} threads x {per_thread} marks")
+    print(f"{'mode':>12} {'marks/s':>10}")
+    print(f"{'direct':>12} {run(direct, threads, per_thread, course_id=1):>10.0f}")
+    print(f"{'direct/full':>12} {run(direct_full, threads, per_thread, course_id=2):>10.0f}")
+    print(f"{'write-behind':>12} {run(grouped, threads, per_thread, course_id=3):>10.0f}")
+    write_behind.drain()
+
+    conn = db.connect()
+    rows = conn.execute("SELECT course_id, COUNT(*) FROM attendance GROUP BY course_id").fetchall()
+    print("rows written:", {course_id: count for course_id, count in rows})
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
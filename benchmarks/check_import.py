@@ -0,0 +1,79 @@
+"""
+Per-row validation test for the bulk student import: one NDJSON batch
+mixing good rows with every kind of bad row the readers and
+import_students() must reject on their own (malformed JSON, missing
+fields, wrong, ragged or non-numeric embeddings, over-long or duplicate
+matric numbers, non-string courses). Checks that each bad row gets its
+own error, the good rows are imported, and the gallery holds exactly
+their faces. Exits non-zero on any mismatch.
+
+    python benchmarks/check_import.py
+"""
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+workdir = tempfile.mkdtemp()
+os.environ.update(
+    ATTENDANCE_DB=os.path.join(workdir, "import.db"),
+    EMBEDDINGS_FILE=os.path.join(workdir, "embeddings.npy"),
+    NAMES_FILE=os.path.join(workdir, "names.npy"),
+    GALLERY_LOG_FILE=os.path.join(workdir, "gallery.log"),
+    CACHE_STAMP_DIR=os.path.join(workdir, "cache_stamps"),
+)
+import db  # noqa: E402
+import enrollment  # noqa: E402
+import gallery  # noqa: E402
+
+FACE = [0.1] * gallery.EMBEDDING_DIM
+
+
+def student(matric_number, **overrides):
+    row = {"first_name": "A", "last_name": "B", "matric_number": matric_number, "level": "100",
+           "courses_offered": ["CSC101"], "embedding": FACE}
+    row.update(overrides)
+    return json.dumps(row)
+
+
+# (NDJSON line, expected error or None for a row that must be imported)
+CASES = [
+    (student("OK1"), None),
+    ("{bad", "invalid JSON"),
+    ("[1, 2]", "expected a JSON object"),
+    (student("NOLEVEL", level=""), "level is required"),
+    (student("NOFACE", embedding=None), "embedding is required"),
+    (student("SHORT", embedding=[0.1] * 12), "embedding must be length 128"),
+    (student("RAGGED", embedding=[[1, 2]] + [0.1] * 127), "embedding must be length 128"),
+    (student("TEXT", embedding=["x"] * gallery.EMBEDDING_DIM), "embedding must be numeric"),
+    (student("L" * (gallery.NAME_BYTES + 1)), f"matric_number longer than {gallery.NAME_BYTES} bytes"),
+    (student("OK1"), "Duplicate matric number in this import"),
+    (student("NUMCOURSE", courses_offered=[5]), "courses_offered must be strings"),
+    (student("OBJCOURSE", courses_offered={"a": 1}), "courses_offered must be strings"),
+    (student("OK2", courses_offered="CSC101;MTH102"), None),
+]
+
+
+def main():
+    db.init_db()
+    conn = db.connect()
+    report = enrollment.import_students(conn, enrollment.read_ndjson(line for line, _ in CASES))
+    got = {e["row"]: e["error"] for e in report["errors"]}
+
+    ok = True
+    for row, (_, expected) in enumerate(CASES, start=1):
+        if got.get(row) != expected:
+            print(f"row {row}: expected {expected!r}, got {got.get(row)!r}")
+            ok = False
+    imported = sum(expected is None for _, expected in CASES)
+    faces = len(gallery.get_gallery()[0])
+    print(f"imported {report['imported']}/{imported}, {len(got)} rows rejected, {faces} faces in the gallery")
+    ok &= report["imported"] == imported == faces
+    conn.close()
+    print("ok" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Consistency test for the trigger-maintained attendance summaries
+(course_sessions, student_course_attendance): replays a random mix of new
+marks, same-day duplicates, write-behind marks and deletions, then checks
+the summaries against the raw attendance rows, and that a rebuild repairs
+a damaged summary. Exits non-zero on any mismatch.
+
+    python benchmarks/check_summaries.py [marks]
+"""
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+workdir = tempfile.mkdtemp()
+os.environ["ATTENDANCE_DB"] = os.path.join(workdir, "summaries.db")
+os.environ["WRITE_BEHIND_DIR"] = os.path.join(workdir, "marks_log")
+import db  # noqa: E402
+import write_behind  # noqa: E402
+from attendance import record_attendance  # noqa: E402
+
+STUDENTS, COURSES, DAYS = 60, 5, 20
+
+
+def report(conn, label):
+    mismatches = db.check_summaries(conn)
+    bad = {table: len(rows) for table, rows in mismatches.items() if rows}
+    print(f"{label}: {'ok' if not bad else f'mismatched rows {bad}'}")
+    return not bad
+
+
+def main():
+    marks = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rng = random.Random(0)
+    db.init_db()
+    conn = db.connect()
+    cursor = conn.cursor()
+    start = datetime(2026, 1, 5, 9, 0)
+
+    for i in range(marks):
+        student_id, course_id = rng.randrange(STUDENTS), rng.randrange(COURSES)
+        now = start + timedelta(days=rng.randrange(DAYS))
+        if i % 10 == 0:
+            write_behind.submit(cursor, [(student_id, course_id, now.strftime("%Y-%m-%d %H:%M:%S"),
+                                          now.strftime("%Y-%m-%d"))])
+        else:
+            # Several students per call, with repeats, like one classroom frame
+            record_attendance(cursor, [student_id, student_id, rng.randrange(STUDENTS)], course_id, now)
+        if i % 97 == 0:
+            cursor.execute("DELETE FROM attendance WHERE id = (SELECT MAX(id) FROM attendance)")
+        conn.commit()
+    write_behind.drain()
+
+    ok = report(conn, "after marking")
+    rows = conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+    print(f"{rows} attendance rows")
+
+    conn.execute("UPDATE student_course_attendance SET attended = attended + 1 WHERE student_id = 0")
+    conn.execute("DELETE FROM course_sessions WHERE course_id = 0")
+    conn.commit()
+    detected = not report(conn, "after damaging summaries (should mismatch)")
+    db.rebuild_summaries(conn)
+    ok &= detected and report(conn, "after rebuild")
+    conn.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
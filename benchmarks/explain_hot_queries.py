@@ -0,0 +1,69 @@
+"""
+Check that the attendance hot queries are answered by index seeks rather
+than full table scans, using EXPLAIN QUERY PLAN on a freshly migrated
+database. Exits non-zero if any query falls back to a scan.
+
+    python benchmarks/explain_hot_queries.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ["ATTENDANCE_DB"] = os.path.join(tempfile.mkdtemp(), "explain.db")
+import db  # noqa: E402
+
+HOT_QUERIES = {
+    "duplicate check": (
+        "SELECT 1 FROM attendance WHERE course_id=? AND student_id=? AND session_date=?",
+        (1, 1, "2026-01-01"),
+    ),
+    "batch duplicate check": (
+        """SELECT DISTINCT student_id FROM attendance
+           WHERE course_id=? AND session_date=? AND student_id IN (?, ?, ?)""",
+        (1, "2026-01-01", 1, 2, 3),
+    ),
+    "sessions per course": (
+        "SELECT COUNT(DISTINCT session_date) FROM attendance WHERE course_id=?",
+        (1,),
+    ),
+    "course roster": (
+        "SELECT student_id FROM student_courses WHERE course_id=?",
+        (1,),
+    ),
+    "tiers: sessions per course (summary)": (
+        "SELECT COUNT(*) FROM course_sessions WHERE course_id=?",
+        (1,),
+    ),
+    "tiers: attended per enrolled student (summary)": (
+        """SELECT s.id, COALESCE(sca.attended, 0) FROM student_courses sc
+           JOIN students s ON s.id = sc.student_id
+           LEFT JOIN student_course_attendance sca
+                  ON sca.student_id = sc.student_id AND sca.course_id = sc.course_id
+           WHERE sc.course_id=?""",
+        (1,),
+    ),
+    "attendance per student": (
+        "SELECT COUNT(*) FROM attendance WHERE student_id=?",
+        (1,),
+    ),
+}
+
+
+def main():
+    db.init_db()
+    conn = db.connect()
+    failed = False
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        lookups = [step for step in plan if step.startswith(("SEARCH", "SCAN"))]
+        # SEARCH means an index or primary-key seek; SCAN walks a whole table or index
+        uses_index = all(step.startswith("SEARCH") for step in lookups)
+        failed |= not uses_index
+        print(f"{'ok' if uses_index else 'SCAN':>4}  {name}: {'; '.join(plan)}")
+    conn.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# cache.py
+"""
+Response cache for dashboard endpoints. Entries are keyed by path and
+role, live for at most CACHE_TTL_S seconds, and are dropped early when
+one of their tags is invalidated: invalidate("attendance") after a mark
+commits, "enrollment" after students register, and so on.
+
+Invalidation has to reach every gunicorn worker, so each tag is a stamp
+file whose mtime is bumped; checking a cached entry costs one stat per tag
+and never touches SQLite. Responses carry an ETag, and a matching
+If-None-Match is answered with 304.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from flask import g, make_response, request
+
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "30"))
+STAMP_DIR = os.getenv("CACHE_STAMP_DIR", "cache_stamps")
+
+_lock = threading.Lock()
+_entries = {}  # (path, role) -> _Entry
+stats = Counter()  # "<endpoint>:<hit|miss|not_modified>" -> count
+
+
+class _Entry:
+    __slots__ = ("body", "mimetype", "etag", "expires", "stamps")
+
+    def __init__(self, body, mimetype, etag, expires, stamps):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = etag
+        self.expires = expires
+        self.stamps = stamps
+
+
+def _stamp_path(tag):
+    return os.path.join(STAMP_DIR, tag)
+
+
+def _stamps(tags):
+    stamps = []
+    for tag in tags:
+        try:
+            stamps.append(os.stat(_stamp_path(tag)).st_mtime_ns)
+        except FileNotFoundError:
+            stamps.append(None)
+    return tuple(stamps)
+
+
+def version(*tags):
+    """Token that changes whenever any of `tags` is invalidated, in any worker"""
+    return _stamps(tags)
+
+
+def invalidate(*tags):
+    """Expire cached responses that depend on any of `tags`, in every worker"""
+    os.makedirs(STAMP_DIR, exist_ok=True)
+    now = time.time_ns()
+    for tag in tags:
+        path = _stamp_path(tag)
+        try:
+            os.utime(path, ns=(now, now))
+        except FileNotFoundError:
+            open(path, "a").close()
+
+
+def _respond(entry, endpoint):
+    if entry.etag in request.if_none_match:
+        stats[f"{endpoint}:not_modified"] += 1
+        response = make_response("", 304)
+    else:
+        response = make_response(entry.body)
+        response.mimetype = entry.mimetype
+    response.set_etag(entry.etag)
+    # Let the browser keep a copy but always revalidate it with us
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def cached(*tags, ttl=None):
+    """
+    Cache a view's 200 responses per (path, role). Use below
+    @token_required so g.user is set.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            endpoint = request.endpoint
+            key = (request.path, g.user.get("role"))
+            # Read the stamps before computing, so a change that commits while
+            # we build the response still invalidates what we store
+            stamps = _stamps(tags)
+            entry = _entries.get(key)
+            if entry is not None and entry.expires > time.monotonic() and entry.stamps == stamps:
+                stats[f"{endpoint}:hit"] += 1
+                return _respond(entry, endpoint)
+
+            stats[f"{endpoint}:miss"] += 1
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            entry = _Entry(body, response.mimetype, hashlib.sha1(body).hexdigest(),
+                           time.monotonic() + (CACHE_TTL_S if ttl is None else ttl), stamps)
+            with _lock:
+                _entries[key] = entry
+            return _respond(entry, endpoint)
+        return wrapper
+    return decorator
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify, g
 from db import get_db
 from auth import token_required
+import cache
 
 courses_bp = Blueprint("courses", __name__)
 
@@ -35,14 +36,13 @@ def create_course():
                 (lecturer_id, course_id),
             )
             conn.commit()
-            conn.close()
+            cache.invalidate("courses")
             return jsonify({
                 "message": f"Course '{name}' assigned to you",
                 "course_id": course_id,
                 "name": name
             })
         else:
-            conn.close()
             return jsonify({"error": "Course already assigned"}), 403
     else:
         cursor.execute(
@@ -50,8 +50,8 @@ def create_course():
             (name, lecturer_id),
         )
         conn.commit()
+        cache.invalidate("courses")
         course_id = cursor.lastrowid
-        conn.close()
         return jsonify({
             "message": f"Course '{name}' created successfully",
             "course_id": course_id,
@@ -68,6 +68,5 @@ def get_my_courses():
     cursor = conn.cursor()
     cursor.execute("SELECT id, name FROM courses WHERE lecturer_id=?", (lecturer_id,))
     courses = [{"course_id": row[0], "name": row[1]} for row in cursor.fetchall()]
-    conn.close()
 
     return jsonify({"courses": courses})
\ No newline at end of file
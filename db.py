@@ -1,11 +1,227 @@
+import os
 import sqlite3
+import threading
+from flask import g
 from werkzeug.security import generate_password_hash
 
+# -------------------------------
+# Connection settings
+# -------------------------------
+DATABASE = os.getenv("ATTENDANCE_DB", "attendance.db")
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256  # comfortably above the number of distinct queries we run
+
+_local = threading.local()
+
+# A second mark for the same student, course and day is silently dropped by
+# the unique index (migration 2); check cursor.rowcount to tell them apart
+INSERT_ATTENDANCE = """
+    INSERT INTO attendance (student_id, course_id, timestamp, session_date)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT DO NOTHING
+"""
+
+
+def connect():
+    """Open a new connection with the pragmas every blueprint relies on"""
+    conn = sqlite3.connect(
+        DATABASE,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    conn.row_factory = sqlite3.Row
+    # WAL lets dashboards read while attendance is being written;
+    # NORMAL is still crash-safe in WAL mode and avoids an fsync per commit
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
 def get_db():
-    return sqlite3.connect("attendance.db")
+    """
+    Connection for the current request. Each thread keeps one open
+    connection and hands it to every request it serves, so prepared
+    statements survive between requests.
+    """
+    if "db" not in g:
+        conn = getattr(_local, "conn", None)
+        if conn is None:
+            conn = _local.conn = connect()
+        g.db = conn
+    return g.db
+
+
+def release_db(exc=None):
+    """Return the request's connection to its thread, discarding unfinished work"""
+    conn = g.pop("db", None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+def init_app(app):
+    app.teardown_appcontext(release_db)
+
+
+# -------------------------------
+# Attendance summaries
+# -------------------------------
+# course_sessions and student_course_attendance are kept in step with the
+# attendance table by triggers, so dashboards read per-course rows instead
+# of aggregating the whole history. Every insert path (marking, the
+# write-behind queue, log replay) goes through the triggers; a mark
+# dropped by ON CONFLICT DO NOTHING fires nothing.
+REBUILD_SUMMARIES = [
+    "DELETE FROM course_sessions",
+    "DELETE FROM student_course_attendance",
+    """INSERT INTO course_sessions (course_id, session_date, attendees)
+       SELECT course_id, session_date, COUNT(*) FROM attendance
+       GROUP BY course_id, session_date""",
+    """INSERT INTO student_course_attendance (student_id, course_id, attended)
+       SELECT student_id, course_id, COUNT(*) FROM attendance
+       GROUP BY student_id, course_id""",
+]
+
+# Each query returns rows whose stored and recomputed counts disagree
+SUMMARY_CHECKS = {
+    "course_sessions": """
+        SELECT course_id, session_date, stored, actual FROM (
+            SELECT cs.course_id, cs.session_date, cs.attendees AS stored,
+                   (SELECT COUNT(*) FROM attendance a
+                    WHERE a.course_id = cs.course_id AND a.session_date = cs.session_date) AS actual
+            FROM course_sessions cs
+            UNION ALL
+            SELECT course_id, session_date, 0, COUNT(*) FROM attendance a
+            WHERE NOT EXISTS (SELECT 1 FROM course_sessions cs
+                              WHERE cs.course_id = a.course_id AND cs.session_date = a.session_date)
+            GROUP BY course_id, session_date
+        ) WHERE stored != actual""",
+    "student_course_attendance": """
+        SELECT student_id, course_id, stored, actual FROM (
+            SELECT sca.student_id, sca.course_id, sca.attended AS stored,
+                   (SELECT COUNT(*) FROM attendance a
+                    WHERE a.student_id = sca.student_id AND a.course_id = sca.course_id) AS actual
+            FROM student_course_attendance sca
+            UNION ALL
+            SELECT student_id, course_id, 0, COUNT(*) FROM attendance a
+            WHERE NOT EXISTS (SELECT 1 FROM student_course_attendance sca
+                              WHERE sca.student_id = a.student_id AND sca.course_id = a.course_id)
+            GROUP BY student_id, course_id
+        ) WHERE stored != actual""",
+}
+
+
+def rebuild_summaries(conn):
+    """Recompute the summary tables from the raw attendance rows"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in REBUILD_SUMMARIES:
+            conn.execute(statement)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def check_summaries(conn):
+    """Return {table: [(key..., stored, actual), ...]} for every mismatched row"""
+    return {table: [tuple(row) for row in conn.execute(sql)] for table, sql in SUMMARY_CHECKS.items()}
+
+
+# -------------------------------
+# Schema migrations
+# -------------------------------
+# Applied in order on top of the base tables created by init_db().
+# PRAGMA user_version records how many have run, so each one runs exactly
+# once per database, even when several workers start at the same time.
+MIGRATIONS = [
+    # 1: stored session date + indexes for the attendance hot queries
+    [
+        "ALTER TABLE attendance ADD COLUMN session_date TEXT",
+        "UPDATE attendance SET session_date = DATE(timestamp)",
+        """CREATE INDEX IF NOT EXISTS idx_attendance_course_student_date
+           ON attendance(course_id, student_id, session_date)""",
+        "CREATE INDEX IF NOT EXISTS idx_attendance_student ON attendance(student_id)",
+        "CREATE INDEX IF NOT EXISTS idx_student_courses_course ON student_courses(course_id)",
+    ],
+    # 2: one attendance row per student, course and session date, enforced
+    # by the database so concurrent markers cannot both insert
+    [
+        """DELETE FROM attendance WHERE id NOT IN (
+               SELECT MIN(id) FROM attendance
+               GROUP BY course_id, student_id, session_date
+           )""",
+        "DROP INDEX IF EXISTS idx_attendance_course_student_date",
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_unique_session
+           ON attendance(course_id, student_id, session_date)""",
+    ],
+    # 3: trigger-maintained attendance summaries for the dashboards
+    [
+        """CREATE TABLE course_sessions (
+               course_id INTEGER NOT NULL,
+               session_date TEXT NOT NULL,
+               attendees INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (course_id, session_date)
+           ) WITHOUT ROWID""",
+        """CREATE TABLE student_course_attendance (
+               student_id INTEGER NOT NULL,
+               course_id INTEGER NOT NULL,
+               attended INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (student_id, course_id)
+           ) WITHOUT ROWID""",
+        """CREATE TRIGGER attendance_summaries_insert AFTER INSERT ON attendance
+           BEGIN
+               INSERT INTO course_sessions (course_id, session_date, attendees)
+               VALUES (NEW.course_id, NEW.session_date, 1)
+               ON CONFLICT (course_id, session_date) DO UPDATE SET attendees = attendees + 1;
+               INSERT INTO student_course_attendance (student_id, course_id, attended)
+               VALUES (NEW.student_id, NEW.course_id, 1)
+               ON CONFLICT (student_id, course_id) DO UPDATE SET attended = attended + 1;
+           END""",
+        """CREATE TRIGGER attendance_summaries_delete AFTER DELETE ON attendance
+           BEGIN
+               UPDATE course_sessions SET attendees = attendees - 1
+               WHERE course_id = OLD.course_id AND session_date = OLD.session_date;
+               DELETE FROM course_sessions
+               WHERE course_id = OLD.course_id AND session_date = OLD.session_date AND attendees <= 0;
+               UPDATE student_course_attendance SET attended = attended - 1
+               WHERE student_id = OLD.student_id AND course_id = OLD.course_id;
+               DELETE FROM student_course_attendance
+               WHERE student_id = OLD.student_id AND course_id = OLD.course_id AND attended <= 0;
+           END""",
+        *REBUILD_SUMMARIES,
+    ],
+    # 4: courses with a live attendance session open (see sessions.py)
+    [
+        """CREATE TABLE live_sessions (
+               course_id INTEGER PRIMARY KEY,
+               opened_by INTEGER,
+               opened_at TEXT NOT NULL,
+               FOREIGN KEY(course_id) REFERENCES courses(id)
+           )""",
+    ],
+]
+
+
+def migrate(conn):
+    for number, statements in enumerate(MIGRATIONS, start=1):
+        # IMMEDIATE takes the write lock before re-checking the version
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+            conn.rollback()
+            continue
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version={number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
 
 def init_db():
-    conn = get_db()
+    conn = connect()
     cursor = conn.cursor()
 
     cursor.execute("""
@@ -67,4 +283,26 @@ def init_db():
     """, ("departmentHOD@mapoly.com", hod_pass, "hod"))
 
     conn.commit()
+    migrate(conn)
+    conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Attendance database maintenance")
+    parser.add_argument("command", choices=["rebuild-summaries", "check-summaries"])
+    args = parser.parse_args()
+
+    init_db()
+    conn = connect()
+    if args.command == "rebuild-summaries":
+        rebuild_summaries(conn)
+    mismatches = check_summaries(conn)
     conn.close()
+    for table, rows in mismatches.items():
+        print(f"{table}: {'ok' if not rows else f'{len(rows)} mismatched rows'}")
+        for row in rows[:20]:
+            print("   ", row)
+    sys.exit(1 if any(mismatches.values()) else 0)
@@ -0,0 +1,252 @@
+# enrollment.py
+"""
+Bulk student import: roster rows plus face embeddings from NDJSON, CSV or
+.npz, validated and written as one batch. Used by /students/import and
+from the command line:
+
+    python enrollment.py roster.ndjson [--format csv|ndjson|npz]
+"""
+import csv
+import io
+import json
+import numpy as np
+import cache
+import gallery
+
+FIELDS = ("first_name", "last_name", "matric_number", "level")
+SQL_CHUNK = 500  # stays under SQLite's bound-parameter limit on old builds
+
+
+# -------------------------------
+# Readers
+# -------------------------------
+# Each yields one dict per roster row with the FIELDS, a list of course
+# names under "courses_offered" and the raw "embedding".
+def _split_courses(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [c for c in value.split(";") if c.strip()]
+    return value  # a JSON array, or something import_students() rejects
+
+
+def read_ndjson(lines):
+    """One JSON object per line, same keys as /students/register"""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = {"_error": "invalid JSON"}
+        if not isinstance(row, dict):
+            row = {"_error": "expected a JSON object"}
+        row["courses_offered"] = _split_courses(row.get("courses_offered"))
+        yield row
+
+
+def read_csv(lines):
+    """
+    Header row with the FIELDS, courses_offered (';'-separated) and
+    embedding (128 space-separated numbers)
+    """
+    text = (line.decode("utf-8") if isinstance(line, bytes) else line for line in lines)
+    for row in csv.DictReader(text):
+        row["courses_offered"] = _split_courses(row.get("courses_offered"))
+        embedding = row.get("embedding")
+        row["embedding"] = embedding.split() if embedding else None
+        yield row
+
+
+def read_npz(fileobj):
+    """
+    `embeddings` (N x 128) plus one length-N array per FIELD and an
+    optional `courses_offered` array of ';'-separated names
+    """
+    with np.load(fileobj, allow_pickle=False) as data:
+        missing = [key for key in ("embeddings", *FIELDS) if key not in data]
+        if missing:
+            raise ValueError(f"npz is missing arrays: {', '.join(missing)}")
+        embeddings = data["embeddings"]
+        columns = {key: data[key].tolist() for key in FIELDS}
+        courses = data["courses_offered"].tolist() if "courses_offered" in data else [""] * len(embeddings)
+    for i, embedding in enumerate(embeddings):
+        row = {key: columns[key][i] for key in FIELDS}
+        row["courses_offered"] = _split_courses(courses[i])
+        row["embedding"] = embedding
+        yield row
+
+
+READERS = {"ndjson": read_ndjson, "csv": read_csv, "npz": read_npz}
+
+
+# -------------------------------
+# Validation
+# -------------------------------
+def _validate_embeddings(raw):
+    """
+    Coerce every embedding in one vectorised pass. Returns an N x 128
+    float32 matrix and a per-row error (None when the row is valid).
+    """
+    errors = [None] * len(raw)
+    shaped = []
+    for i, embedding in enumerate(raw):
+        if embedding is None:
+            errors[i] = "embedding is required"
+            continue
+        try:
+            # np.ndim raises on ragged rows such as [[1, 2], 0.1, ...]
+            shaped_ok = np.ndim(embedding) == 1 and len(embedding) == gallery.EMBEDDING_DIM
+        except (TypeError, ValueError):
+            shaped_ok = False
+        if shaped_ok:
+            shaped.append(i)
+        else:
+            errors[i] = f"embedding must be length {gallery.EMBEDDING_DIM}"
+
+    matrix = np.zeros((len(raw), gallery.EMBEDDING_DIM), dtype=np.float32)
+    try:
+        matrix[shaped] = np.array([raw[i] for i in shaped], dtype=np.float32).reshape(-1, gallery.EMBEDDING_DIM)
+    except (TypeError, ValueError):
+        # Some row has a non-numeric value; find which ones individually
+        for i in shaped:
+            try:
+                matrix[i] = np.asarray(raw[i], dtype=np.float32)
+            except (TypeError, ValueError):
+                errors[i] = "embedding must be numeric"
+
+    finite = np.isfinite(matrix).all(axis=1)
+    for i in np.flatnonzero(~finite):
+        errors[i] = errors[i] or "embedding must be finite"
+    return matrix, errors
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), SQL_CHUNK):
+        yield values[start:start + SQL_CHUNK]
+
+
+def _select_in(cursor, sql, values):
+    """Run `sql` (with one {placeholders} slot) over `values` in chunks"""
+    rows = []
+    for chunk in _chunks(values):
+        cursor.execute(sql.format(placeholders=",".join("?" * len(chunk))), chunk)
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+# -------------------------------
+# Import
+# -------------------------------
+def import_students(conn, rows):
+    """
+    Validate and insert roster rows in one transaction, then append their
+    embeddings to the gallery in one write. Invalid rows are reported and
+    skipped; the rest of the batch still goes in.
+    Returns {"imported": count, "errors": [{"row", "matric_number", "error"}]}.
+    """
+    rows = list(rows)
+    errors = []
+
+    def reject(i, message):
+        errors.append({"row": i + 1, "matric_number": rows[i].get("matric_number"), "error": message})
+
+    embeddings, embedding_errors = _validate_embeddings([row.get("embedding") for row in rows])
+
+    cleaned, seen = [], set()
+    for i, row in enumerate(rows):
+        if "_error" in row:
+            reject(i, row["_error"])
+            continue
+        values = {key: str(row.get(key) or "").strip() for key in FIELDS}
+        missing = next((key for key in FIELDS if not values[key]), None)
+        if missing:
+            reject(i, f"{missing} is required")
+        elif embedding_errors[i]:
+            reject(i, embedding_errors[i])
+        elif len(values["matric_number"].encode("utf-8")) > gallery.NAME_BYTES:
+            reject(i, f"matric_number longer than {gallery.NAME_BYTES} bytes")
+        elif values["matric_number"] in seen:
+            reject(i, "Duplicate matric number in this import")
+        elif not isinstance(row["courses_offered"], list) or \
+                not all(isinstance(c, str) for c in row["courses_offered"]):
+            reject(i, "courses_offered must be strings")
+        else:
+            seen.add(values["matric_number"])
+            values["courses"] = sorted({c.strip() for c in row["courses_offered"] if c.strip()})
+            cleaned.append((i, values))
+
+    cursor = conn.cursor()
+    existing = {r[0] for r in _select_in(
+        cursor, "SELECT matric_number FROM students WHERE matric_number IN ({placeholders})", seen)}
+    accepted = []
+    for i, values in cleaned:
+        if values["matric_number"] in existing:
+            reject(i, "Matric number already exists")
+        else:
+            accepted.append((i, values))
+
+    if accepted:
+        try:
+            cursor.executemany("""
+                INSERT INTO students (first_name, last_name, matric_number, level, name)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(v["first_name"], v["last_name"], v["matric_number"], v["level"],
+                   f"{v['first_name']} {v['last_name']}") for _, v in accepted])
+            student_ids = dict(_select_in(
+                cursor, "SELECT matric_number, id FROM students WHERE matric_number IN ({placeholders})",
+                [v["matric_number"] for _, v in accepted]))
+
+            course_names = sorted({c for _, v in accepted for c in v["courses"]})
+            cursor.executemany("INSERT OR IGNORE INTO courses (name, lecturer_id) VALUES (?, NULL)",
+                               [(name,) for name in course_names])
+            course_ids = dict(_select_in(
+                cursor, "SELECT name, id FROM courses WHERE name IN ({placeholders})", course_names))
+
+            cursor.executemany(
+                "INSERT OR IGNORE INTO student_courses (student_id, course_id) VALUES (?, ?)",
+                [(student_ids[v["matric_number"]], course_ids[c]) for _, v in accepted for c in v["courses"]])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        cache.invalidate("enrollment", "courses")
+
+        # Save embeddings (visible to every worker on its next match)
+        gallery.append_many(embeddings[[i for i, _ in accepted]], [v["matric_number"] for _, v in accepted])
+
+    errors.sort(key=lambda e: e["row"])
+    return {"imported": len(accepted), "errors": errors}
+
+
+def main():
+    import argparse
+    import db
+
+    parser = argparse.ArgumentParser(description="Bulk-import students with face embeddings")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=sorted(READERS),
+                        help="defaults to the file extension")
+    args = parser.parse_args()
+
+    fmt = args.format or args.path.rsplit(".", 1)[-1].lower()
+    if fmt not in READERS:
+        parser.error(f"cannot tell the format of {args.path}; pass --format")
+
+    db.init_db()
+    conn = db.connect()
+    with open(args.path, "rb") as f:
+        source = f if fmt == "npz" else io.TextIOWrapper(f, encoding="utf-8")
+        report = import_students(conn, READERS[fmt](source))
+    conn.close()
+
+    print(f"imported {report['imported']} students, {len(report['errors'])} rejected")
+    for error in report["errors"]:
+        print(f"  row {error['row']} ({error['matric_number']}): {error['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# export.py
+"""
+Attendance export for registrars: attendance rows joined with their
+student and course, filtered by session date range and course, streamed
+in chunks of CHUNK_ROWS so the full result is never held in memory. Used
+by /attendance/export and from the command line:
+
+    python export.py report.parquet [--format csv|arrow|parquet]
+                     [--from 2026-01-01] [--to 2026-05-31] [--course 3]
+
+CSV needs nothing extra. The columnar formats (Arrow IPC stream and
+Parquet, one record batch / row group per chunk) use pyarrow, which is in
+requirements.txt; a slimmer install without it still exports CSV and
+answers the columnar formats with ExportUnavailable.
+"""
+import csv
+import io
+import os
+import re
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # installs without pyarrow export CSV only
+    pa = pq = None
+
+CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "65536"))
+
+COLUMNS = ("attendance_id", "session_date", "timestamp", "course_id", "course_name",
+           "student_id", "matric_number", "student_name")
+
+EXPORT_QUERY = """
+    SELECT a.id, a.session_date, a.timestamp, a.course_id, c.name,
+           a.student_id, s.matric_number, s.first_name || ' ' || s.last_name
+    FROM attendance a
+    JOIN students s ON s.id = a.student_id
+    JOIN courses c ON c.id = a.course_id
+    WHERE a.session_date BETWEEN ? AND ? {course_filter}
+    ORDER BY a.id
+"""
+
+DATE = re.compile(r"\d{4}-\d{2}-\d{2}$")
+
+
+class ExportUnavailable(RuntimeError):
+    """The requested format needs pyarrow, which is not installed"""
+
+
+# -------------------------------
+# Query
+# -------------------------------
+def iter_chunks(conn, start=None, end=None, course_id=None):
+    """
+    Yield the matching rows as lists of tuples (in COLUMNS order), at
+    most CHUNK_ROWS at a time. start/end are inclusive YYYY-MM-DD dates.
+    """
+    for value in (start, end):
+        if value is not None and not DATE.match(value):
+            raise ValueError("dates must be YYYY-MM-DD")
+    params = [start or "0000-00-00", end or "9999-99-99"]
+    if course_id is not None:
+        params.append(int(course_id))
+    sql = EXPORT_QUERY.format(course_filter="AND a.course_id = ?" if course_id is not None else "")
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(CHUNK_ROWS)
+        if not rows:
+            return
+        yield [tuple(row) for row in rows]
+
+
+# -------------------------------
+# Writers
+# -------------------------------
+# Each takes the chunks from iter_chunks and yields encoded bytes, so the
+# endpoint can stream them and the CLI can write them to a file.
+class _Sink:
+    """Write-only file object that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def write_csv(chunks):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield text.getvalue().encode("utf-8")
+        text.seek(0)
+        text.truncate()
+    if text.tell():
+        yield text.getvalue().encode("utf-8")
+
+
+def _schema():
+    return pa.schema([
+        ("attendance_id", pa.int64()), ("session_date", pa.string()), ("timestamp", pa.string()),
+        ("course_id", pa.int64()), ("course_name", pa.string()), ("student_id", pa.int64()),
+        ("matric_number", pa.string()), ("student_name", pa.string()),
+    ])
+
+
+def _batch(schema, rows):
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+
+
+def write_arrow(chunks):
+    schema = _schema()
+    sink = _Sink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for rows in chunks:
+            writer.write_batch(_batch(schema, rows))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def write_parquet(chunks):
+    schema = _schema()
+    sink = _Sink()
+    with pq.ParquetWriter(sink, schema, compression="snappy") as writer:
+        for rows in chunks:
+            writer.write_batch(_batch(schema, rows))
+            yield sink.drain()
+    yield sink.drain()
+
+
+WRITERS = {"csv": write_csv, "arrow": write_arrow, "parquet": write_parquet}
+EXTENSIONS = {"csv": "csv", "arrow": "arrows", "parquet": "parquet"}
+FORMATS_BY_EXTENSION = {"csv": "csv", "arrow": "arrow", "arrows": "arrow", "parquet": "parquet"}
+MIMETYPES = {
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _prepend(first, chunks):
+    if first:
+        yield first
+    yield from chunks
+
+
+def export(conn, fmt, start=None, end=None, course_id=None):
+    """
+    Generator of the export encoded as `fmt`, in chunks. Raises ExportUnavailable for a
+    columnar format without pyarrow and ValueError for a bad filter.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"format must be one of {', '.join(sorted(WRITERS))}")
+    if fmt != "csv" and pa is None:
+        raise ExportUnavailable(f"{fmt} export needs pyarrow, which is not installed")
+    chunks = iter_chunks(conn, start, end, course_id)
+    # Run the query now so filter errors surface before any bytes are sent
+    first = next(chunks, [])
+    return WRITERS[fmt](_prepend(first, chunks))
+
+
+def main():
+    import argparse
+    import db
+
+    parser = argparse.ArgumentParser(description="Export attendance rows with student and course")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=sorted(WRITERS), help="defaults to the file extension")
+    parser.add_argument("--from", dest="start", help="first session date, YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", help="last session date, YYYY-MM-DD")
+    parser.add_argument("--course", type=int, help="course id")
+    args = parser.parse_args()
+
+    fmt = args.format or FORMATS_BY_EXTENSION.get(args.path.rsplit(".", 1)[-1].lower())
+    if fmt is None:
+        parser.error(f"cannot tell the format of {args.path}; pass --format")
+
+    conn = db.connect()
+    try:
+        stream = export(conn, fmt, args.start, args.end, args.course)
+    except (ExportUnavailable, ValueError) as e:
+        parser.error(str(e))
+    with open(args.path, "wb") as f:
+        for data in stream:
+            f.write(data)
+    conn.close()
+    print(f"wrote {args.path}")
+
+
+if __name__ == "__main__":
+    main()
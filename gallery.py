@@ -0,0 +1,723 @@
+# gallery.py
+import os
+import threading
+from collections import Counter, namedtuple
+import numpy as np
+import ivf
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, no cross-worker lock needed
+    fcntl = None
+
+# -------------------------------
+# Embeddings storage
+# -------------------------------
+# The gallery is a base pair of .npy files plus an append-only log of
+# fixed-size records. Registering a face appends one record; the log is
+# folded back into the base files once it is as large as the base, so each
+# face is rewritten O(1) times on average instead of once per registration.
+EMBEDDINGS_FILE = os.getenv("EMBEDDINGS_FILE", "models/known_face_embeddings.npy")
+NAMES_FILE = os.getenv("NAMES_FILE", "models/known_face_names.npy")
+LOG_FILE = os.getenv("GALLERY_LOG_FILE", "models/known_face_gallery.log")
+LOCK_FILE = EMBEDDINGS_FILE + ".lock"
+EMBEDDING_DIM = 128
+NAME_BYTES = 64
+COMPACT_MIN = int(os.getenv("GALLERY_COMPACT_MIN", "1024"))
+
+# Log layout: an int64 header holding the base row count the log was started
+# from, then one record per appended face
+LOG_HEADER = np.dtype("<i8")
+LOG_RECORD = np.dtype([("name", f"S{NAME_BYTES}"), ("embedding", "<f4", (EMBEDDING_DIM,))])
+
+# "exact" scans every face; "ivf" uses the approximate index in ivf.py
+MATCHER_MODE = os.getenv("MATCHER_MODE", "exact")
+IVF_MIN_FACES = int(os.getenv("IVF_MIN_FACES", "5000"))
+
+# "float16" or "int8" scans a quantized copy of the gallery, written by
+# compact() to SCAN_CODES_FILE beside the base file and mapped by every
+# worker; the RERANK_CANDIDATES best rows per query are then re-ranked in
+# float32, read from the mapped base file or the small tail appended since.
+# SCAN_META_FILE records which base file (inode, rows) the codes belong to
+# and the int8 scale.
+SCAN_DTYPE = os.getenv("GALLERY_SCAN_DTYPE", "float32")
+SCAN_CODES_FILE = f"{os.path.splitext(EMBEDDINGS_FILE)[0]}.{SCAN_DTYPE}.npy"
+SCAN_META_FILE = f"{os.path.splitext(EMBEDDINGS_FILE)[0]}.{SCAN_DTYPE}.meta.npz"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "8"))
+SCAN_BLOCK_ROWS = 8192
+
+# A student may have several rows (templates) under one name. With
+# TEMPLATE_MATCHING=1 each query is compared with every student's centroid
+# first, re-ranked over the templates of the CENTROID_CANDIDATES closest
+# students, and the TEMPLATE_VOTE_K nearest templates vote for the name.
+# Only templates within TEMPLATE_VOTE_MARGIN of the nearest one vote, so a
+# student with many so-so templates cannot outvote a much closer student
+# who has few.
+TEMPLATE_MATCHING = os.getenv("TEMPLATE_MATCHING", "0") == "1"
+CENTROID_CANDIDATES = int(os.getenv("CENTROID_CANDIDATES", "8"))
+TEMPLATE_VOTE_K = int(os.getenv("TEMPLATE_VOTE_K", "3"))
+TEMPLATE_VOTE_MARGIN = float(os.getenv("TEMPLATE_VOTE_MARGIN", "0.03"))
+
+# embeddings: float32 rows (a _FullRows reader in quantized mode);
+# sq_norms: squared norms of the rows the scan uses; index/templates/scan:
+# optional matchers, None when not in use
+Snapshot = namedtuple("Snapshot", "embeddings names sq_norms index templates scan")
+
+_lock = threading.Lock()
+_UNLOADED = object()  # distinct from the None version of an empty gallery
+_state = {"version": _UNLOADED, "snapshot": None, "rows": None, "index": None, "log_read": 0}
+
+
+def _use_index(count):
+    return MATCHER_MODE == "ivf" and count >= IVF_MIN_FACES
+
+
+def _empty():
+    return np.empty((0, EMBEDDING_DIM), dtype=np.float32), np.array([])
+
+
+def _grow(array, count, needed):
+    """`array` with room for `needed` rows, keeping the first `count`"""
+    if needed <= len(array):
+        return array
+    grown = np.empty((max(needed, 2 * len(array), 16),) + array.shape[1:], dtype=array.dtype)
+    grown[:count] = array[:count]
+    return grown
+
+
+class _FullRows:
+    """Float32 reader over the mapped base file followed by the appended tail"""
+
+    def __init__(self, base, tail, count):
+        self.base, self.tail, self.count = base, tail, count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, rows):
+        rows = np.arange(self.count)[rows] if isinstance(rows, slice) else np.asarray(rows)
+        out = np.empty(rows.shape + (EMBEDDING_DIM,), dtype=np.float32)
+        in_base = rows < len(self.base)
+        out[in_base] = self.base[rows[in_base]]
+        out[~in_base] = self.tail[rows[~in_base] - len(self.base)]
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        # A full private copy; only for callers that really need one matrix
+        return self[:] if dtype is None else self[:].astype(dtype)
+
+    def parts(self):
+        """(first row, rows) for the base and the tail, without copying either"""
+        return (0, self.base), (len(self.base), self.tail[:self.count - len(self.base)])
+
+
+class _Rows:
+    """
+    In-memory side of the gallery: the squared norm of every row and the
+    names. The float32 rows stay in the mapped base file, shared by every
+    worker through the page cache; only rows appended since it was written
+    are copied into `tail`, which grows by doubling. Rows below `count`
+    are never rewritten, so snapshots handed out earlier stay valid.
+    """
+
+    def __init__(self, base, names):
+        self.base = base if base.dtype == np.float32 else base.astype(np.float32)
+        self.tail = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self.names = np.asarray(names, dtype=object)
+        self.count = len(self.base)
+        self.sq_norms = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, SCAN_BLOCK_ROWS):
+            self.sq_norms[start:start + SCAN_BLOCK_ROWS] = self._base_norms(start, start + SCAN_BLOCK_ROWS)
+
+    def _base_norms(self, start, stop):
+        block = np.asarray(self.base[start:stop], dtype=np.float32)
+        return np.einsum("ij,ij->i", block, block)
+
+    def _encode(self, embeddings):
+        """Keep whatever appended rows need besides the tail; returns their squared norms"""
+        return np.einsum("ij,ij->i", embeddings, embeddings)
+
+    def extend(self, embeddings, names):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        end = self.count + len(embeddings)
+        tail_count = self.count - len(self.base)
+        self.tail = _grow(self.tail, tail_count, tail_count + len(embeddings))
+        self.tail[tail_count:tail_count + len(embeddings)] = embeddings
+        self.sq_norms = _grow(self.sq_norms, self.count, end)
+        self.names = _grow(self.names, self.count, end)
+        self.sq_norms[self.count:end] = self._encode(embeddings)
+        self.names[self.count:end] = list(names)
+        self.count = end
+
+    def view(self):
+        n = self.count
+        return _FullRows(self.base, self.tail, n), self.names[:n], self.sq_norms[:n], None
+
+
+class _Scan:
+    """
+    Quantized scan matrix. int8 codes use one scale per dimension, fixed
+    when the codes file is written (appended rows are clipped to it until
+    the next compaction); float16 needs none.
+    """
+
+    def __init__(self, dtype, sample=None, scale=None):
+        self.dtype = np.dtype(dtype)
+        self.scale = scale
+        if self.dtype == np.int8 and scale is None:
+            peak = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+            for start in range(0, len(sample), SCAN_BLOCK_ROWS):
+                block = np.abs(np.asarray(sample[start:start + SCAN_BLOCK_ROWS], dtype=np.float32))
+                np.maximum(peak, block.max(axis=0), out=peak)
+            self.scale = np.where(peak > 0, peak, 1.0).astype(np.float32) / 127
+
+    def encode(self, embeddings):
+        if self.scale is None:
+            return embeddings.astype(self.dtype)
+        return np.clip(np.rint(embeddings / self.scale), -127, 127).astype(np.int8)
+
+    def sq_norms(self, codes):
+        """Squared norms of what `codes` decode to, without a decoded copy"""
+        if self.scale is None:
+            return np.einsum("ij,ij->i", codes, codes, dtype=np.float32)
+        return np.einsum("ij,ij,j->i", codes, codes, self.scale * self.scale, dtype=np.float32)
+
+    def candidates(self, parts, sq_norms, queries, count):
+        """The `count` rows per query with the best approximate distance over (first row, codes) parts"""
+        weighted = queries if self.scale is None else queries * self.scale
+        total = sum(len(codes) for _, codes in parts)
+        scores = np.empty((len(queries), total), dtype=np.float32)
+        # Decode a block at a time so the float32 copy stays small
+        for offset, codes in parts:
+            for start in range(0, len(codes), SCAN_BLOCK_ROWS):
+                block = codes[start:start + SCAN_BLOCK_ROWS].astype(np.float32)
+                first = offset + start
+                part = scores[:, first:first + len(block)]
+                np.matmul(weighted, block.T, out=part)
+                part *= -2.0
+                part += sq_norms[first:first + len(block)]
+        count = min(count, total)
+        return np.argpartition(scores, count - 1, axis=1)[:, :count]
+
+
+class _QuantizedRows(_Rows):
+    """
+    _Rows for GALLERY_SCAN_DTYPE float16/int8. The base rows' codes are
+    mapped from SCAN_CODES_FILE, shared like the base file itself; only
+    the codes of appended rows are private. sq_norms are the norms of what
+    the codes decode to.
+    """
+
+    def __init__(self, base, names, base_ino=None):
+        base = base if base.dtype == np.float32 else base.astype(np.float32)
+        shared = _shared_codes(base, base_ino) if len(base) else None
+        if shared is None:
+            # Files not writable, or a compaction raced this load: encode privately
+            self.scan = _Scan(SCAN_DTYPE, base)
+            self.base_codes = np.empty((len(base), EMBEDDING_DIM), dtype=self.scan.dtype)
+            for start in range(0, len(base), SCAN_BLOCK_ROWS):
+                block = np.asarray(base[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+                self.base_codes[start:start + SCAN_BLOCK_ROWS] = self.scan.encode(block)
+        else:
+            self.scan, self.base_codes = shared
+        self.tail_codes = np.empty((0, EMBEDDING_DIM), dtype=self.scan.dtype)
+        super().__init__(base, names)
+
+    def _base_norms(self, start, stop):
+        return self.scan.sq_norms(self.base_codes[start:stop])
+
+    def _encode(self, embeddings):
+        codes = self.scan.encode(embeddings)
+        tail_count = self.count - len(self.base)
+        self.tail_codes = _grow(self.tail_codes, tail_count, tail_count + len(codes))
+        self.tail_codes[tail_count:tail_count + len(codes)] = codes
+        return self.scan.sq_norms(codes)
+
+    def view(self):
+        full, names, sq_norms, _ = super().view()
+        parts = ((0, self.base_codes), (len(self.base), self.tail_codes[:self.count - len(self.base)]))
+        return full, names, sq_norms, (self.scan, parts)
+
+
+class _Templates:
+    """
+    Per-student view of a snapshot for TEMPLATE_MATCHING: one centroid per
+    name and the rows holding each name's templates. Built on first match,
+    so snapshots that are never matched against cost nothing.
+    """
+
+    def __init__(self, embeddings, names):
+        self.embeddings = embeddings
+        self.names = names
+        self._built = None
+
+    def _build(self):
+        if self._built is None:
+            students, inverse = np.unique(self.names, return_inverse=True)
+            order = np.argsort(inverse, kind="stable")
+            counts = np.bincount(inverse, minlength=len(students))
+            starts = np.concatenate([[0], np.cumsum(counts)])
+            sums = np.add.reduceat(self.embeddings[order].astype(np.float64), starts[:-1], axis=0)
+            centroids = np.ascontiguousarray(sums / counts[:, None], dtype=np.float32)
+            self._built = (centroids, np.einsum("ij,ij->i", centroids, centroids), order, starts)
+        return self._built
+
+    def nearest_many(self, queries):
+        centroids, centroid_sq, order, starts = self._build()
+        if len(centroids) > CENTROID_CANDIDATES:
+            scores = queries @ centroids.T
+            scores *= -2.0
+            scores += centroid_sq
+            candidates = np.argpartition(scores, CENTROID_CANDIDATES - 1, axis=1)[:, :CENTROID_CANDIDATES]
+        else:
+            candidates = np.broadcast_to(np.arange(len(centroids)), (len(queries), len(centroids)))
+
+        results = []
+        for query, students in zip(queries, candidates):
+            rows = np.concatenate([order[starts[s]:starts[s + 1]] for s in students])
+            distances = np.linalg.norm(self.embeddings[rows].astype(np.float64) - query, axis=1)
+            k = min(TEMPLATE_VOTE_K, len(rows))
+            votes, closest = Counter(), {}
+            nearest = distances.min()
+            for i in np.argpartition(distances, k - 1)[:k]:
+                if distances[i] > nearest + TEMPLATE_VOTE_MARGIN:
+                    continue
+                name = self.names[rows[i]]
+                votes[name] += 1
+                closest[name] = min(closest.get(name, np.inf), distances[i])
+            # Most votes wins; a tie goes to the student with the closer template
+            winner = max(votes, key=lambda name: (votes[name], -closest[name]))
+            results.append((winner, float(closest[winner])))
+        return results
+
+
+def _snapshot(rows, index):
+    """
+    Matching view of the gallery: the float32 rows (mapped base plus tail)
+    and their squared norms, which are computed once per face instead of
+    per query.
+    """
+    embeddings, names, sq_norms, scan = rows.view()
+    templates = _Templates(embeddings, names) if TEMPLATE_MATCHING else None
+    return Snapshot(embeddings, names, sq_norms, index, templates, scan)
+
+
+def _index_for(embeddings):
+    """
+    IVF index over `embeddings` (trained on the float32 rows, so not used
+    in quantized mode), or None for an exact scan. Retraining happens in
+    compact(); only the very first index is trained here, by one worker
+    under the file lock while the others wait for it.
+    """
+    if SCAN_DTYPE != "float32" or not _use_index(len(embeddings)):
+        return None
+    index = ivf.load_for(embeddings)
+    if index is None and not os.path.exists(ivf.INDEX_FILE):
+        with _FileLock():
+            if not os.path.exists(ivf.INDEX_FILE):
+                ivf.IVFIndex.train(embeddings).save()
+        index = ivf.load_for(embeddings)
+    return index
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _file_version():
+    """Identify the files currently on disk; changes whenever a worker appends"""
+    base = (_stat(EMBEDDINGS_FILE), _stat(NAMES_FILE))
+    log = _stat(LOG_FILE)
+    if base == (None, None) and log is None:
+        return None
+    return base, log
+
+
+def _load_array(path):
+    """Memory-map the file so only the pages we copy are read"""
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # Older galleries were saved as object arrays, which cannot be mapped
+        return np.load(path, allow_pickle=True)
+    except FileNotFoundError:
+        return None
+
+
+def _load_base():
+    embeddings = _load_array(EMBEDDINGS_FILE)
+    names = _load_array(NAMES_FILE)
+    if embeddings is None or names is None:
+        return _empty()
+    # Names are written before embeddings, so a reader racing a compaction
+    # may briefly see extra names; only expose rows present in both files.
+    count = min(len(embeddings), len(names))
+    return embeddings[:count], names[:count]
+
+
+def _read_log(start=0):
+    """Return (base count the log follows, records from `start` on)"""
+    try:
+        with open(LOG_FILE, "rb") as f:
+            header = np.fromfile(f, dtype=LOG_HEADER, count=1)
+            if len(header) == 0:
+                return None, np.empty(0, dtype=LOG_RECORD)
+            f.seek(LOG_HEADER.itemsize + start * LOG_RECORD.itemsize)
+            # A torn final record (crash mid-append) is left out by the count
+            return int(header[0]), np.fromfile(f, dtype=LOG_RECORD)
+    except FileNotFoundError:
+        return None, np.empty(0, dtype=LOG_RECORD)
+
+
+def _decode(records):
+    return [name.decode("utf-8") for name in records["name"]]
+
+
+def _load_parts():
+    """
+    Read the gallery as (base embeddings, base names, log records not in
+    the base, log records read). The log is read before the base:
+    compaction replaces the base first, so whichever pair we see, log
+    records already folded into the base can be skipped by comparing the
+    header with the base row count.
+    """
+    base_count, records = _read_log()
+    embeddings, names = _load_base()
+    if base_count is None:
+        return embeddings, names, records[:0], 0
+    return embeddings, names, records[max(0, len(embeddings) - base_count):], len(records)
+
+
+def _load():
+    """Read the whole gallery as (embeddings, names, log records read)"""
+    embeddings, names, fresh, log_read = _load_parts()
+    embeddings = np.concatenate([np.asarray(embeddings, dtype=np.float32), fresh["embedding"]])
+    names = np.concatenate([np.asarray(names, dtype=object), np.array(_decode(fresh), dtype=object)])
+    return embeddings, names, log_read
+
+
+def _save_codes(base):
+    """Write the quantized scan codes of `base` (the current base file). Callers hold the file lock."""
+    scan = _Scan(SCAN_DTYPE, base)
+    tmp_path = f"{SCAN_CODES_FILE}.tmp.{os.getpid()}"
+    codes = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=scan.dtype, shape=(len(base), EMBEDDING_DIM))
+    for start in range(0, len(base), SCAN_BLOCK_ROWS):
+        codes[start:start + SCAN_BLOCK_ROWS] = scan.encode(
+            np.asarray(base[start:start + SCAN_BLOCK_ROWS], dtype=np.float32))
+    codes.flush()
+    del codes
+    os.replace(tmp_path, SCAN_CODES_FILE)
+    # Written last: readers trust the codes only if this names their base file
+    tmp_path = f"{SCAN_META_FILE}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, base_ino=os.stat(EMBEDDINGS_FILE).st_ino, count=len(base),
+                 scale=scan.scale if scan.scale is not None else np.empty(0, dtype=np.float32))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, SCAN_META_FILE)
+
+
+def _load_codes(count, base_ino):
+    """(scan, mapped codes) if the codes file belongs to the base file `base_ino` of `count` rows"""
+    try:
+        with np.load(SCAN_META_FILE) as meta:
+            ino, rows, scale = int(meta["base_ino"]), int(meta["count"]), meta["scale"]
+        codes = np.load(SCAN_CODES_FILE, mmap_mode="r")
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+    if ino != base_ino or rows != count or codes.shape != (count, EMBEDDING_DIM) or codes.dtype != SCAN_DTYPE:
+        return None
+    return _Scan(SCAN_DTYPE, scale=scale if len(scale) else None), codes
+
+
+def _shared_codes(base, base_ino):
+    """
+    Mapped scan codes for the base file, written once under the file lock
+    when missing or stale (e.g. the scan mode was just switched on); None
+    if they cannot be written or the base file changed under us.
+    """
+    shared = _load_codes(len(base), base_ino)
+    if shared is not None or base_ino is None:
+        return shared
+    try:
+        with _FileLock():
+            shared = _load_codes(len(base), base_ino)
+            current = _stat(EMBEDDINGS_FILE)
+            if shared is None and current is not None and current[0] == base_ino:
+                _save_codes(base)
+                shared = _load_codes(len(base), base_ino)
+    except OSError:
+        return None
+    return shared
+
+
+def _rewrite_float32():
+    """
+    Rewrite a base file saved in another dtype (older galleries, including
+    the bundled one, are float64 or pickled objects) as float32, once, by
+    compacting under the file lock. Returns False if the files cannot be
+    written; _Rows then falls back to a private float32 copy.
+    """
+    try:
+        with _FileLock():
+            base = _load_array(EMBEDDINGS_FILE)
+            if base is not None and base.dtype != np.float32:
+                compact()
+    except OSError:
+        return False
+    return True
+
+
+def _refresh(version):
+    old = _state["version"]
+    rows = _state["rows"]
+    if (rows is not None and old not in (None, _UNLOADED) and version is not None
+            and old[0] == version[0] and old[1] and version[1]
+            and old[1][0] == version[1][0] and version[1][2] >= old[1][2]):
+        # Same base files and same log, only longer: add just the new records
+        _, records = _read_log(_state["log_read"])
+        rows.extend(records["embedding"], _decode(records))
+        _state["log_read"] += len(records)
+        index = _state["index"]
+        if index is not None:
+            index = index.extended(records["embedding"])
+        else:
+            index = _index_for(rows.view()[0])
+    else:
+        embeddings, names, fresh, log_read = _load_parts() if version else (*_empty(), None, 0)
+        if embeddings.dtype != np.float32 and _rewrite_float32():
+            version = _file_version()
+            embeddings, names, fresh, log_read = _load_parts()
+        names = np.asarray(names, dtype=object)
+        if SCAN_DTYPE == "float32":
+            rows = _Rows(embeddings, names)
+        else:
+            base_stat = version[0][0] if version else None
+            rows = _QuantizedRows(embeddings, names, base_stat[0] if base_stat else None)
+        if fresh is not None:
+            rows.extend(fresh["embedding"], _decode(fresh))
+        _state.update(rows=rows, log_read=log_read)
+        index = _index_for(rows.view()[0])
+    _state.update(index=index, snapshot=_snapshot(rows, index))
+    _state["version"] = version
+
+
+def _current():
+    version = _file_version()
+    if version == _state["version"]:
+        return _state["snapshot"]
+
+    with _lock:
+        if version != _state["version"]:
+            _refresh(version)
+    return _state["snapshot"]
+
+
+def disk_version():
+    """Like version(), but only stats the files: nothing is loaded"""
+    return _file_version()
+
+
+def partition(shard, count):
+    """
+    Snapshot of just the rows i with i % count == shard, read from the
+    mapped base file and the log without holding the rest of the gallery.
+    Used by the shard servers in shards.py.
+    """
+    base, names, fresh, _ = _load_parts()
+    embeddings = np.asarray(base[shard::count], dtype=np.float32)
+    names = np.asarray(names[shard::count], dtype=object)
+    # Log record j is gallery row len(base) + j
+    tail = fresh[(shard - len(base)) % count::count]
+    if len(tail):
+        embeddings = np.concatenate([embeddings, tail["embedding"]])
+        names = np.concatenate([names, np.array(_decode(tail), dtype=object)])
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    return Snapshot(embeddings, names, np.einsum("ij,ij->i", embeddings, embeddings), None, None, None)
+
+
+def get_gallery():
+    """
+    Return (embeddings, names), reloading only if another worker
+    (or this one) has appended to the gallery since the last call.
+    """
+    embeddings, names = _current()[:2]
+    return embeddings, names
+
+
+def version():
+    """Opaque token that changes whenever the gallery on disk changes"""
+    _current()
+    return _state["version"]
+
+
+def subset(wanted_names):
+    """
+    Snapshot restricted to the given names (e.g. one course's students),
+    copied into its own small contiguous matrix for repeated matching.
+    """
+    embeddings, names = _current()[:2]
+    rows = np.flatnonzero(np.isin(names, list(wanted_names)))
+    embeddings, names = np.ascontiguousarray(embeddings[rows]), names[rows]
+    templates = _Templates(embeddings, names) if TEMPLATE_MATCHING else None
+    return Snapshot(embeddings, names, np.einsum("ij,ij->i", embeddings, embeddings), None, templates, None)
+
+
+def nearest_rows(embeddings, sq_norms, queries):
+    """
+    Index and squared Euclidean distance of the closest gallery row for each
+    query, using ||g - q||^2 = ||g||^2 - 2 g.q + ||q||^2 so the only large
+    operation is one GEMM instead of an N x 128 difference per query.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    parts = embeddings.parts() if isinstance(embeddings, _FullRows) else ((0, embeddings),)
+    indices = np.zeros(len(queries), dtype=np.int64)
+    best = np.full(len(queries), np.inf, dtype=np.float32)
+    for offset, rows in parts:
+        if len(rows) == 0:
+            continue
+        scores = queries @ rows.T
+        scores *= -2.0
+        scores += sq_norms[offset:offset + len(rows)]
+        part_best = np.argmin(scores, axis=1)
+        part_scores = scores[np.arange(len(queries)), part_best]
+        better = part_scores < best
+        indices[better] = part_best[better] + offset
+        best[better] = part_scores[better]
+    best += np.einsum("ij,ij->i", queries, queries)
+    return indices, np.maximum(best, 0.0)
+
+
+def nearest(embedding, snapshot=None):
+    """
+    Return (name, distance) of the closest face, or (None, None) if the
+    gallery is empty. The winner's distance is recomputed exactly so the
+    caller's threshold sees the same value as a direct norm.
+    Pass a snapshot from subset() to search only part of the gallery.
+    """
+    query = np.asarray(embedding, dtype=np.float32).reshape(1, EMBEDDING_DIM)
+    return nearest_many(query, snapshot)[0]
+
+
+def nearest_many(queries, snapshot=None):
+    """
+    Same as nearest() for an M x 128 batch, matched in one M x N product
+    (or, with TEMPLATE_MATCHING, by centroid prefilter and template vote)
+    """
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    embeddings, names, sq_norms, index, templates, scan = snapshot or _current()
+    if len(embeddings) == 0:
+        return [(None, None)] * len(queries)
+
+    if templates is not None:
+        return templates.nearest_many(queries)
+    if scan is not None:
+        # Approximate scan, then exact distances for the best few rows
+        candidates = scan[0].candidates(scan[1], sq_norms, queries, RERANK_CANDIDATES)
+        exact = np.linalg.norm(embeddings[candidates].astype(np.float64) - queries[:, None, :], axis=2)
+        best = exact.argmin(axis=1)
+        return [(names[candidates[i, b]], float(exact[i, b])) for i, b in enumerate(best)]
+    if index is not None:
+        indices, _ = index.search(embeddings, sq_norms, queries)
+    else:
+        indices, _ = nearest_rows(embeddings, sq_norms, queries)
+    distances = np.linalg.norm(embeddings[indices].astype(np.float64) - queries, axis=1)
+    return [(names[i], float(d)) for i, d in zip(indices, distances)]
+
+
+def _atomic_save(path, array):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+    # Readers that already mapped the old file keep a valid view of it
+    os.replace(tmp_path, path)
+
+
+def _start_log(base_count):
+    """Atomically replace the log with an empty one following `base_count` base rows"""
+    tmp_path = f"{LOG_FILE}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(np.array([base_count], dtype=LOG_HEADER).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, LOG_FILE)
+
+
+class _FileLock:
+    """Serialise gallery writers across gunicorn workers"""
+
+    def __enter__(self):
+        self.fh = open(LOCK_FILE, "a")
+        if fcntl:
+            fcntl.flock(self.fh, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.fh, fcntl.LOCK_UN)
+        self.fh.close()
+
+
+def compact():
+    """
+    Fold the log into the base .npy files. Callers must hold the file lock.
+    The base is replaced before the log is reset, so a crash in between
+    leaves records that _load() already knows to skip.
+    """
+    embeddings, names, _ = _load()
+    _atomic_save(NAMES_FILE, np.array(list(names), dtype=str))
+    _atomic_save(EMBEDDINGS_FILE, np.ascontiguousarray(embeddings, dtype=np.float32))
+    _start_log(len(embeddings))
+    if SCAN_DTYPE != "float32" and len(embeddings):
+        _save_codes(embeddings)
+
+    if _use_index(len(embeddings)):
+        # The only place the index is retrained: under the lock, once per
+        # compaction. Readers insert faces appended since then in memory.
+        ivf.rebuild(embeddings)
+
+
+def append(embedding, name):
+    """Add one face to the gallery and make it visible to all workers"""
+    append_many(np.asarray(embedding, dtype=np.float32).reshape(1, EMBEDDING_DIM), [name])
+
+
+def append_many(embeddings, names):
+    """Add a batch of faces with a single log write and fsync"""
+    embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    encoded = [str(name).encode("utf-8") for name in names]
+    if len(encoded) != len(embeddings):
+        raise ValueError("embeddings and names must have the same length")
+    too_long = [name for name in encoded if len(name) > NAME_BYTES]
+    if too_long:
+        raise ValueError(f"name longer than {NAME_BYTES} bytes: {too_long[0].decode()!r}")
+    if not encoded:
+        return
+    records = np.zeros(len(encoded), dtype=LOG_RECORD)
+    records["embedding"] = embeddings
+    records["name"] = encoded
+
+    os.makedirs(os.path.dirname(EMBEDDINGS_FILE) or ".", exist_ok=True)
+    with _lock, _FileLock():
+        if not os.path.exists(LOG_FILE):
+            _start_log(len(_load_base()[0]))
+
+        with open(LOG_FILE, "r+b") as f:
+            base_count = int(np.fromfile(f, dtype=LOG_HEADER, count=1)[0])
+            size = f.seek(0, os.SEEK_END)
+            count = (size - LOG_HEADER.itemsize) // LOG_RECORD.itemsize
+            # Drop a torn record left by a crash so every record stays aligned
+            f.truncate(LOG_HEADER.itemsize + count * LOG_RECORD.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        if count + len(records) >= max(COMPACT_MIN, base_count):
+            compact()
@@ -1,24 +1,18 @@
 # hod.py
 from flask import Blueprint, jsonify, g
-import sqlite3
+from db import get_db
 from auth import token_required
+import analytics
+import cache
 
 hod_bp = Blueprint("hod", __name__)
 
-# -------------------------------
-# Utility to open DB
-# -------------------------------
-def get_db():
-    conn = sqlite3.connect("attendance.db")
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
 # -------------------------------
 # Dashboard Overview
 # -------------------------------
 @hod_bp.route("/overview", methods=["GET"])
 @token_required
+@cache.cached("attendance", "enrollment", "courses", "lecturers")
 def overview():
     if g.user.get("role") not in ["hod", "admin"]:
         return jsonify({"error": "Unauthorized"}), 403
@@ -45,7 +39,6 @@ def overview():
             (total_attendance / (total_students * total_courses)) * 100, 2
         )
 
-    conn.close()
     return jsonify({
         "total_students": total_students,
         "total_lecturers": total_lecturers,
@@ -59,29 +52,12 @@ def overview():
 # -------------------------------
 @hod_bp.route("/courses", methods=["GET"])
 @token_required
+@cache.cached("attendance", "enrollment", "courses", "lecturers")
 def courses_summary():
     if g.user.get("role") not in ["hod", "admin"]:
         return jsonify({"error": "Unauthorized"}), 403
 
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT c.id as course_id, c.name, l.username as lecturer,
-               COUNT(sc.student_id) as student_count,
-               COALESCE(ROUND(
-                   (CAST(COUNT(a.id) AS FLOAT) / NULLIF(COUNT(sc.student_id),0)) * 100, 2
-               ), 0) as average_attendance
-        FROM courses c
-        LEFT JOIN lecturers l ON c.lecturer_id = l.id
-        LEFT JOIN student_courses sc ON c.id = sc.course_id
-        LEFT JOIN attendance a ON c.id = a.course_id
-        GROUP BY c.id
-    """)
-    rows = cursor.fetchall()
-    conn.close()
-
-    return jsonify([dict(r) for r in rows])
+    return jsonify(analytics.courses_summary(get_db()))
 
 
 # -------------------------------
@@ -89,6 +65,7 @@ def courses_summary():
 # -------------------------------
 @hod_bp.route("/lecturers", methods=["GET"])
 @token_required
+@cache.cached("courses", "lecturers")
 def lecturers():
     if g.user.get("role") not in ["hod", "admin"]:
         return jsonify({"error": "Unauthorized"}), 403
@@ -105,36 +82,30 @@ def lecturers():
         GROUP BY l.id
     """)
     rows = cursor.fetchall()
-    conn.close()
 
     return jsonify([dict(r) for r in rows])
 
 
 # -------------------------------
-# Low Attendance Students (<=25%)
+# Low Attendance Students (<=25% of sessions)
 # -------------------------------
 @hod_bp.route("/low_attendance", methods=["GET"])
 @token_required
+@cache.cached("attendance", "enrollment")
 def low_attendance():
     if g.user.get("role") not in ["hod", "admin"]:
         return jsonify({"error": "Unauthorized"}), 403
 
-    conn = get_db()
-    cursor = conn.cursor()
+    return jsonify(analytics.low_attendance(get_db()))
 
-    cursor.execute("""
-        SELECT s.id as student_id, s.first_name || ' ' || s.last_name as name,
-               s.matric_number,
-               COUNT(a.id) as attended_sessions,
-               (COUNT(a.id) * 100.0 / NULLIF((SELECT COUNT(*) FROM courses c
-                                             JOIN student_courses sc ON sc.course_id=c.id
-                                             WHERE sc.student_id=s.id),0)) as percentage
-        FROM students s
-        LEFT JOIN attendance a ON s.id = a.student_id
-        GROUP BY s.id
-        HAVING percentage <= 25
-    """)
-    rows = cursor.fetchall()
-    conn.close()
 
-    return jsonify([dict(r) for r in rows])
+# -------------------------------
+# Cache counters (dashboard responses, verified tokens)
+# -------------------------------
+@hod_bp.route("/cache_stats", methods=["GET"])
+@token_required
+def cache_stats():
+    if g.user.get("role") not in ["hod", "admin"]:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    return jsonify(dict(cache.stats))
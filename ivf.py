@@ -0,0 +1,162 @@
+# ivf.py
+import copy
+import os
+import numpy as np
+
+# -------------------------------
+# Inverted-file (IVF) index config
+# -------------------------------
+INDEX_FILE = os.getenv("IVF_INDEX_FILE", "models/known_face_ivf.npz")
+NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+KMEANS_ITERATIONS = 10
+TRAIN_SAMPLE = 50_000
+RETRAIN_GROWTH = 4  # retrain once the gallery is this many times the trained size
+
+
+def _nearest_centroids(centroids, centroid_sq, vectors, count=1):
+    scores = vectors @ centroids.T
+    scores *= -2.0
+    scores += centroid_sq
+    if count == 1:
+        return np.argmin(scores, axis=1)[:, None]
+    count = min(count, len(centroids))
+    return np.argpartition(scores, count - 1, axis=1)[:, :count]
+
+
+class IVFIndex:
+    """
+    Coarse k-means quantiser over the gallery. Each row lives in the
+    inverted list of its nearest centroid; a query only scans the lists
+    of its NPROBE nearest centroids instead of the whole gallery.
+    """
+
+    def __init__(self, centroids, assignments, trained_count):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.centroid_sq = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self.trained_count = int(trained_count)
+
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.cumsum(np.bincount(self.assignments, minlength=len(self.centroids)))
+        self.lists = np.split(order.astype(np.int64), bounds[:-1])
+
+    def __len__(self):
+        return len(self.assignments)
+
+    @classmethod
+    def train(cls, embeddings, seed=0):
+        """Fit sqrt(N) centroids with a few Lloyd iterations on a sample"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        nlist = max(1, int(np.sqrt(len(embeddings))))
+        rng = np.random.default_rng(seed)
+
+        sample = embeddings
+        if len(embeddings) > TRAIN_SAMPLE:
+            sample = embeddings[np.sort(rng.choice(len(embeddings), TRAIN_SAMPLE, replace=False))]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            centroid_sq = np.einsum("ij,ij->i", centroids, centroids)
+            labels = _nearest_centroids(centroids, centroid_sq, sample)[:, 0]
+            counts = np.bincount(labels, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+        index = cls(centroids, np.empty(0, dtype=np.int32), len(embeddings))
+        index.add(embeddings)
+        return index
+
+    def add(self, vectors):
+        """Incrementally insert rows appended to the end of the gallery"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.centroids.shape[1])
+        if len(vectors) == 0:
+            return
+        start = len(self.assignments)
+        labels = _nearest_centroids(self.centroids, self.centroid_sq, vectors)[:, 0]
+        for label in np.unique(labels):
+            rows = start + np.flatnonzero(labels == label)
+            self.lists[label] = np.concatenate([self.lists[label], rows])
+        self.assignments = np.concatenate([self.assignments, labels.astype(np.int32)])
+
+    def extended(self, vectors):
+        """Copy with `vectors` added; this index stays as it is for snapshots still using it"""
+        index = copy.copy(self)
+        index.lists = list(self.lists)
+        index.add(vectors)
+        return index
+
+    def needs_retrain(self):
+        return len(self) > RETRAIN_GROWTH * max(self.trained_count, 1)
+
+    def search(self, embeddings, sq_norms, queries, nprobe=NPROBE):
+        """
+        Approximate (index, squared distance) of the nearest row per query,
+        scanning only the probed inverted lists.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        probes = _nearest_centroids(self.centroids, self.centroid_sq, queries, nprobe)
+        query_sq = np.einsum("ij,ij->i", queries, queries)
+
+        indices = np.zeros(len(queries), dtype=np.int64)
+        sq_distances = np.full(len(queries), np.inf, dtype=np.float32)
+        for i, probe in enumerate(probes):
+            rows = np.concatenate([self.lists[p] for p in probe])
+            if len(rows) == 0:
+                continue
+            scores = embeddings[rows] @ queries[i]
+            scores *= -2.0
+            scores += sq_norms[rows]
+            best = np.argmin(scores)
+            indices[i] = rows[best]
+            sq_distances[i] = max(scores[best] + query_sq[i], 0.0)
+        return indices, sq_distances
+
+    def save(self, path=INDEX_FILE):
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=self.centroids, assignments=self.assignments,
+                     trained_count=self.trained_count)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        with np.load(path) as data:
+            return cls(data["centroids"], data["assignments"], data["trained_count"])
+
+
+def load():
+    """The saved index, or None if there is none (or it cannot be read)"""
+    try:
+        return IVFIndex.load()
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+
+
+def load_for(embeddings):
+    """
+    The saved index with any rows of `embeddings` appended since it was
+    saved inserted in memory, or None when no saved index fits. Never
+    trains; that is rebuild()'s job.
+    """
+    index = load()
+    if index is None or len(index) > len(embeddings):
+        return None
+    index.add(embeddings[len(index):])
+    return index
+
+
+def rebuild(embeddings):
+    """
+    Bring the saved index up to `embeddings`, retraining it when missing
+    or RETRAIN_GROWTH times its trained size, and save it. Callers hold
+    the gallery file lock.
+    """
+    index = load_for(embeddings)
+    if index is None or index.needs_retrain():
+        index = IVFIndex.train(embeddings)
+    index.save()
+    return index
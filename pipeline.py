@@ -0,0 +1,136 @@
+# pipeline.py
+"""
+Optional server-side face pipeline: JPEG -> face boxes -> 128-d embeddings,
+so clients can send a photo instead of computing embeddings themselves.
+
+Needs opencv-python-headless plus two model files next to deploy.prototxt:
+the SSD detector weights it describes and an OpenFace-style 128-d
+embedder. Without them the rest of the app works as before and
+/attendance/mark_image answers 503.
+"""
+import os
+import time
+import numpy as np
+import recognition
+from gallery import EMBEDDING_DIM
+
+try:
+    import cv2
+except ImportError:  # server-side detection is optional
+    cv2 = None
+
+# -------------------------------
+# Model config
+# -------------------------------
+DETECTOR_PROTO = os.getenv("FACE_DETECTOR_PROTO", "deploy.prototxt")
+DETECTOR_WEIGHTS = os.getenv("FACE_DETECTOR_WEIGHTS", "models/res10_300x300_ssd_iter_140000.caffemodel")
+EMBEDDER_MODEL = os.getenv("FACE_EMBEDDER_MODEL", "models/openface_nn4.small2.v1.t7")
+DETECTION_CONFIDENCE = float(os.getenv("FACE_DETECTION_CONFIDENCE", "0.5"))
+
+DETECTOR_SIZE = (300, 300)
+DETECTOR_MEAN = (104.0, 177.0, 123.0)
+EMBEDDER_SIZE = (96, 96)
+
+_state = {"models": {}}  # factory -> model, per worker process
+
+
+class PipelineUnavailable(RuntimeError):
+    """OpenCV or the model files are missing"""
+
+
+class OpenCVFaceModel:
+    """
+    SSD face detector (deploy.prototxt) followed by the embedder network,
+    built once in each recognition worker process.
+    """
+
+    def __init__(self):
+        self.detector = cv2.dnn.readNetFromCaffe(DETECTOR_PROTO, DETECTOR_WEIGHTS)
+        self.embedder = cv2.dnn.readNetFromTorch(EMBEDDER_MODEL)
+
+    def detect(self, image):
+        """Return an N x 4 int array of (x1, y1, x2, y2) boxes above the confidence cut"""
+        height, width = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, DETECTOR_SIZE), 1.0, DETECTOR_SIZE, DETECTOR_MEAN)
+        self.detector.setInput(blob)
+        detections = self.detector.forward()[0, 0]
+        detections = detections[detections[:, 2] >= DETECTION_CONFIDENCE]
+        boxes = detections[:, 3:7] * np.array([width, height, width, height])
+        boxes = np.clip(boxes, 0, [width, height, width, height]).astype(int)
+        return boxes[(boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])]
+
+    def embed(self, image, boxes):
+        """Return an N x 128 float32 matrix, one embedding per box, in one forward pass"""
+        if len(boxes) == 0:
+            return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        crops = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes]
+        blob = cv2.dnn.blobFromImages(crops, 1.0 / 255, EMBEDDER_SIZE, (0, 0, 0), swapRB=True)
+        self.embedder.setInput(blob)
+        return self.embedder.forward().astype(np.float32).reshape(-1, EMBEDDING_DIM)
+
+
+def _missing_files():
+    return [path for path in (DETECTOR_PROTO, DETECTOR_WEIGHTS, EMBEDDER_MODEL) if not os.path.exists(path)]
+
+
+def _default_model():
+    return OpenCVFaceModel()
+
+
+# Swapped by set_model_factory() for a stand-in model in benchmarks
+_model_factory = _default_model
+
+
+def set_model_factory(factory):
+    """
+    Build the workers' model with `factory()` (must offer detect/embed).
+    The factory is sent to the worker processes, so it must be importable.
+    """
+    global _model_factory
+    _model_factory = factory
+
+
+def _model(factory):
+    model = _state["models"].get(factory)
+    if model is None:
+        model = _state["models"][factory] = factory()
+    return model
+
+
+def extract(image_bytes, factory=_default_model):
+    """Runs in a recognition worker: decode, detect and embed one image"""
+    timings = {}
+    start = time.perf_counter()
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("image could not be decoded")
+    timings["decode_ms"] = (time.perf_counter() - start) * 1000
+
+    model = _model(factory)
+    start = time.perf_counter()
+    boxes = model.detect(image)
+    timings["detect_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    embeddings = model.embed(image, boxes)
+    timings["embed_ms"] = (time.perf_counter() - start) * 1000
+    return embeddings, np.asarray(boxes).reshape(-1, 4), timings
+
+
+def process(image_bytes):
+    """
+    Detect and embed every face in an encoded image on the recognition pool.
+    Returns (N x 128 embeddings, N x 4 boxes, per-stage timings in ms).
+    Raises PipelineUnavailable, ValueError for an undecodable image, or
+    recognition.Overloaded / DeadlineExceeded.
+    """
+    if cv2 is None:
+        raise PipelineUnavailable("opencv-python-headless is not installed")
+    missing = _missing_files() if _model_factory is _default_model else []
+    if missing:
+        raise PipelineUnavailable(f"model files not found: {', '.join(missing)}")
+    queued = time.perf_counter()
+    embeddings, boxes, timings = recognition.submit(extract, image_bytes, _model_factory)
+    total_ms = (time.perf_counter() - queued) * 1000
+    timings["queue_ms"] = max(0.0, total_ms - sum(timings.values()))
+    return embeddings, boxes, timings
@@ -0,0 +1,203 @@
+# recognition.py
+"""
+Recognition worker pool: CPU-heavy work (image decode, detection,
+embedding and, with MATCH_IN_POOL=1, gallery matching) runs in separate
+processes so it holds neither the gunicorn worker's request threads nor
+its GIL.
+
+The pool takes at most MAX_PENDING jobs; beyond that submit() raises
+Overloaded and the endpoint answers 503 with Retry-After. Every job has a
+deadline: one that is still queued when it expires is dropped by the
+worker instead of being run for a client that has given up. Match
+requests arriving within BATCH_WINDOW_MS are stacked and matched as one
+matrix product.
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor, TimeoutError as FutureTimeout
+import numpy as np
+import gallery
+
+# -------------------------------
+# Pool config
+# -------------------------------
+WORKERS = int(os.getenv("RECOGNITION_WORKERS", str(os.cpu_count() or 1)))
+MAX_PENDING = int(os.getenv("RECOGNITION_MAX_PENDING", str(4 * WORKERS)))
+DEADLINE_MS = float(os.getenv("RECOGNITION_DEADLINE_MS", "5000"))
+RETRY_AFTER_S = int(os.getenv("RECOGNITION_RETRY_AFTER_S", "1"))
+MATCH_IN_POOL = os.getenv("MATCH_IN_POOL", "0") == "1"
+BATCH_WINDOW_MS = float(os.getenv("RECOGNITION_BATCH_WINDOW_MS", "2"))
+BATCH_MAX_QUERIES = int(os.getenv("RECOGNITION_BATCH_MAX_QUERIES", "512"))
+
+_lock = threading.Lock()
+_state = {"pid": None, "pool": None, "slots": None, "batcher": None}
+
+
+class Overloaded(RuntimeError):
+    """The job queue is full; the client should retry after `retry_after` seconds"""
+
+    def __init__(self, message="recognition queue is full"):
+        super().__init__(message)
+        self.retry_after = RETRY_AFTER_S
+
+
+class DeadlineExceeded(TimeoutError):
+    """The job did not finish before its deadline"""
+
+
+def _run_job(deadline, fn, args):
+    # Runs in the worker process; time.time() is shared across processes
+    if time.time() > deadline:
+        raise DeadlineExceeded("job expired while queued")
+    return fn(*args)
+
+
+def _started():
+    """Pool for this process, created on first use (and again after a fork)"""
+    pid = os.getpid()
+    if _state["pid"] != pid:
+        with _lock:
+            if _state["pid"] != pid:
+                # spawn, not fork: children must not inherit sqlite handles,
+                # locks or the threads of the gunicorn worker
+                pool = ProcessPoolExecutor(WORKERS, mp_context=multiprocessing.get_context("spawn"))
+                _state.update(pid=pid, pool=pool, slots=threading.BoundedSemaphore(MAX_PENDING),
+                              batcher=None)
+    return _state
+
+
+def _submit(deadline, fn, args, block=False):
+    state = _started()
+    if not state["slots"].acquire(blocking=block):
+        raise Overloaded()
+    try:
+        future = state["pool"].submit(_run_job, deadline, fn, args)
+    except Exception:
+        state["slots"].release()
+        raise
+    # The slot stays taken until the worker is done, even if the caller gave up
+    future.add_done_callback(lambda _: state["slots"].release())
+    return future
+
+
+def _wait(future, deadline):
+    try:
+        return future.result(timeout=max(0.0, deadline - time.time()))
+    except FutureTimeout:
+        future.cancel()
+        raise DeadlineExceeded("recognition job timed out") from None
+
+
+def submit(fn, *args, deadline_ms=None):
+    """
+    Run `fn(*args)` in the pool and return its result. `fn` must be a
+    module-level function so it can be sent to the worker processes.
+    Raises Overloaded when the queue is full and DeadlineExceeded when the
+    result is not ready within `deadline_ms` (default DEADLINE_MS).
+    """
+    deadline = time.time() + (deadline_ms or DEADLINE_MS) / 1000
+    return _wait(_submit(deadline, fn, args), deadline)
+
+
+# -------------------------------
+# Batched matching
+# -------------------------------
+def _match_batch(queries):
+    # Runs in the worker process against its own copy of the gallery
+    return gallery.nearest_many(queries)
+
+
+def _settle(future, result=None, exception=None):
+    """Complete a caller's future unless it already gave up on it"""
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class _Batcher(threading.Thread):
+    """Stacks match requests that arrive close together into one pool job"""
+
+    def __init__(self):
+        super().__init__(name="recognition-batcher", daemon=True)
+        self.queue = queue.Queue(maxsize=MAX_PENDING)
+
+    def run(self):
+        while True:
+            group = [self.queue.get()]
+            size = len(group[0][0])
+            window_end = time.monotonic() + BATCH_WINDOW_MS / 1000
+            while size < BATCH_MAX_QUERIES:
+                try:
+                    item = self.queue.get(timeout=max(0.0, window_end - time.monotonic()))
+                except queue.Empty:
+                    break
+                group.append(item)
+                size += len(item[0])
+            self._dispatch(group)
+
+    def _dispatch(self, group):
+        live = [item for item in group if not item[2].cancelled()]
+        if not live:
+            return
+        stacked = np.concatenate([queries for queries, _, _ in live])
+        deadline = max(d for _, d, _ in live)
+        try:
+            # Blocks while the pool is full; callers see Overloaded once our queue fills too
+            job = _submit(deadline, _match_batch, (stacked,), block=True)
+        except Exception as exc:
+            for _, _, future in live:
+                _settle(future, exception=exc)
+            return
+
+        def scatter(job):
+            try:
+                matches = job.result()
+            except Exception as exc:
+                for _, _, future in live:
+                    _settle(future, exception=exc)
+                return
+            start = 0
+            for queries, _, future in live:
+                _settle(future, result=matches[start:start + len(queries)])
+                start += len(queries)
+
+        job.add_done_callback(scatter)
+
+
+def match(queries, deadline_ms=None):
+    """
+    Nearest gallery face for each row of `queries` (M x 128), computed in
+    the pool together with any other requests from the same window.
+    Returns a list of (name, distance) like gallery.nearest_many().
+    """
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, gallery.EMBEDDING_DIM)
+    if len(queries) == 0:
+        return []
+    deadline = time.time() + (deadline_ms or DEADLINE_MS) / 1000
+    state = _started()
+    if state["batcher"] is None:
+        with _lock:
+            if state["batcher"] is None:
+                state["batcher"] = _Batcher()
+                state["batcher"].start()
+
+    future = Future()
+    try:
+        state["batcher"].queue.put_nowait((queries, deadline, future))
+    except queue.Full:
+        raise Overloaded() from None
+    return _wait(future, deadline)
+
+
+def shutdown():
+    with _lock:
+        if _state["pool"] is not None and _state["pid"] == os.getpid():
+            _state["pool"].shutdown(wait=True, cancel_futures=True)
+        _state.update(pid=None, pool=None, slots=None, batcher=None)
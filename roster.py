@@ -0,0 +1,69 @@
+# roster.py
+"""
+Process-local copy of the student roster and course enrollments for the
+marking hot path: matric number -> (student id, display name) and, per
+course, a sorted array of enrolled student ids. With it a successful mark
+reads nothing from SQLite and only inserts.
+
+Registration and bulk import invalidate the "enrollment" cache tag after
+they commit; the copy is rebuilt on the first lookup that sees the tag's
+stamp change (one stat, the same check the dashboard cache makes).
+"""
+import threading
+import numpy as np
+import cache
+
+TAG = "enrollment"
+_EMPTY = np.empty(0, dtype=np.int64)
+
+_lock = threading.Lock()
+_state = {"roster": None}
+
+
+class Roster:
+    """One immutable load of the roster; `version` is the stamp it was loaded under"""
+
+    def __init__(self, cursor, version):
+        self.version = version
+        cursor.execute("SELECT matric_number, id, first_name, last_name FROM students")
+        self._students = {row[0]: (row[1], f"{row[2]} {row[3]}") for row in cursor.fetchall()}
+        self._matric_by_id = {student_id: matric for matric, (student_id, _) in self._students.items()}
+
+        cursor.execute("SELECT course_id, student_id FROM student_courses ORDER BY course_id, student_id")
+        pairs = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+        # One sorted id array per course, split where the course id changes
+        starts = np.flatnonzero(np.diff(pairs[:, 0], prepend=-1))
+        self._courses = {int(pairs[start, 0]): ids
+                         for start, ids in zip(starts, np.split(pairs[:, 1], starts[1:]))}
+
+    def students(self, matric_numbers):
+        """{matric_number: (student_id, name)} for those that exist"""
+        return {m: self._students[m] for m in matric_numbers if m in self._students}
+
+    def enrolled(self, course_id, student_ids):
+        """The subset of `student_ids` enrolled in `course_id`"""
+        ids = self._courses.get(int(course_id), _EMPTY)
+        wanted = np.fromiter(student_ids, dtype=np.int64)
+        if len(ids) == 0 or len(wanted) == 0:
+            return set()
+        slots = np.minimum(np.searchsorted(ids, wanted), len(ids) - 1)
+        return set(wanted[ids[slots] == wanted].tolist())
+
+    def members(self, course_id):
+        """Matric numbers of every student enrolled in `course_id`"""
+        ids = self._courses.get(int(course_id), _EMPTY)
+        return [self._matric_by_id[i] for i in ids.tolist() if i in self._matric_by_id]
+
+
+def current(cursor):
+    """The roster as of the latest enrollment change, reloaded through `cursor` if stale"""
+    version = cache.version(TAG)
+    roster = _state["roster"]
+    if roster is None or roster.version != version:
+        with _lock:
+            roster = _state["roster"]
+            if roster is None or roster.version != version:
+                # Stamp read before loading: a change committed meanwhile
+                # bumps it again and triggers another reload
+                roster = _state["roster"] = Roster(cursor, version)
+    return roster
@@ -0,0 +1,173 @@
+# sessions.py
+"""
+Live attendance sessions. While a session is open for a course, the
+frames a classroom camera keeps sending pass through two in-memory layers
+before the usual match-and-insert path:
+
+1. similarity cache: a face within SIMILAR_DISTANCE of one matched in the
+   last SIMILAR_TTL_S seconds reuses that match instead of searching the
+   gallery again, provided the match still holds for the new face (its
+   distance plus the hop stays within the threshold)
+2. marked set: a student already marked for today's session is answered
+   "Already marked today" without touching SQLite
+
+Open sessions are rows in live_sessions, so every gunicorn worker knows
+about them (re-read when the "sessions" cache tag changes). The layers
+and their counters are per worker; a mark made by another worker is still
+caught by the unique index, one layer later.
+"""
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+import numpy as np
+import cache
+from gallery import EMBEDDING_DIM
+
+SIMILAR_DISTANCE = float(os.getenv("SESSION_SIMILAR_DISTANCE", "0.08"))
+SIMILAR_TTL_S = float(os.getenv("SESSION_SIMILAR_TTL_S", "10"))
+SIMILAR_MAX = int(os.getenv("SESSION_SIMILAR_MAX", "256"))
+TAG = "sessions"
+
+_lock = threading.Lock()
+_state = {"version": object(), "open": {}}  # course_id -> live_sessions row
+_live = {}  # course_id -> LiveSession
+
+
+class LiveSession:
+    """This worker's view of one open session"""
+
+    def __init__(self, course_id, opened_at, session_date, marked):
+        self.course_id = course_id
+        self.opened_at = opened_at
+        self.session_date = session_date
+        self.marked = set(marked)
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._faces = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._matches = []
+        self._seen = np.empty(0)
+
+    def recall(self, embeddings, threshold=0.6):
+        """
+        The match of a recently seen face for each row of `embeddings`, or
+        None. A match at distance d recalled across a hop h is at most d + h
+        from the new face, so it is reused (with d + h as its distance) only
+        when that bound is within `threshold`; the recalled student is then
+        within 2h of the best one the gallery would have found.
+        """
+        now = time.monotonic()
+        with self._lock:
+            fresh = self._seen > now - SIMILAR_TTL_S
+            if not fresh.all():
+                self._faces, self._seen = self._faces[fresh], self._seen[fresh]
+                self._sq_norms = self._sq_norms[fresh]
+                self._matches = [m for m, keep in zip(self._matches, fresh) if keep]
+            faces, sq_norms, matches = self._faces, self._sq_norms, self._matches
+
+        recalled = [None] * len(embeddings)
+        if len(faces):
+            # ||e - f||^2 = ||e||^2 - 2 e.f + ||f||^2, one M x K product
+            scores = embeddings @ faces.T
+            scores *= -2.0
+            scores += sq_norms
+            nearest = scores.argmin(axis=1)
+            hops = np.sqrt(np.maximum(scores[np.arange(len(embeddings)), nearest]
+                                      + np.einsum("ij,ij->i", embeddings, embeddings), 0.0))
+            for i, (j, hop) in enumerate(zip(nearest, hops)):
+                matric_number, distance = matches[j]
+                if hop <= SIMILAR_DISTANCE and distance + hop <= threshold:
+                    recalled[i] = (matric_number, float(distance + hop))
+        similar = sum(m is not None for m in recalled)
+        self.stats.update(frames=1, faces=len(embeddings), similar=similar)
+        return recalled
+
+    def remember(self, embeddings, matches):
+        """Keep the faces that matched someone for recall() to find"""
+        keep = [i for i, (matric_number, _) in enumerate(matches) if matric_number is not None]
+        self.stats["matched"] += len(matches)
+        if not keep:
+            return
+        with self._lock:
+            self._faces = np.concatenate([self._faces, embeddings[keep]])[-SIMILAR_MAX:]
+            self._sq_norms = np.concatenate(
+                [self._sq_norms, np.einsum("ij,ij->i", embeddings[keep], embeddings[keep])])[-SIMILAR_MAX:]
+            self._matches = (self._matches + [matches[i] for i in keep])[-SIMILAR_MAX:]
+            self._seen = np.concatenate([self._seen, np.full(len(keep), time.monotonic())])[-SIMILAR_MAX:]
+
+    def already_marked(self, student_id):
+        if student_id in self.marked:
+            self.stats["already_marked"] += 1
+            return True
+        return False
+
+    def mark(self, student_ids):
+        """Record students that are now marked (new or not) for this session"""
+        self.stats["written"] += len(student_ids)
+        self.marked.update(student_ids)
+
+
+def _today():
+    # Same session date record_attendance() stores
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def _open_sessions(cursor):
+    version = cache.version(TAG)
+    if _state["version"] != version:
+        with _lock:
+            if _state["version"] != version:
+                cursor.execute("SELECT course_id, opened_by, opened_at FROM live_sessions")
+                rows = {row[0]: dict(row) for row in cursor.fetchall()}
+                for course_id in set(_live) - set(rows):
+                    del _live[course_id]
+                _state.update(open=rows, version=version)
+    return _state["open"]
+
+
+def get(cursor, course_id):
+    """This worker's LiveSession for `course_id`, or None when no session is open"""
+    row = _open_sessions(cursor).get(int(course_id))
+    if row is None:
+        return None
+    today = _today()
+    live = _live.get(row["course_id"])
+    if live is None or live.opened_at != row["opened_at"] or live.session_date != today:
+        with _lock:
+            live = _live.get(row["course_id"])
+            if live is None or live.opened_at != row["opened_at"] or live.session_date != today:
+                cursor.execute("SELECT student_id FROM attendance WHERE course_id=? AND session_date=?",
+                               (row["course_id"], today))
+                marked = [r[0] for r in cursor.fetchall()]
+                live = _live[row["course_id"]] = LiveSession(row["course_id"], row["opened_at"], today, marked)
+    return live
+
+
+def open_session(conn, course_id, user_id):
+    """Open a session for `course_id` (no-op if one is open); returns its row"""
+    conn.execute("""
+        INSERT INTO live_sessions (course_id, opened_by, opened_at) VALUES (?, ?, ?)
+        ON CONFLICT (course_id) DO NOTHING
+    """, (course_id, user_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    conn.commit()
+    cache.invalidate(TAG)
+    row = conn.execute("SELECT course_id, opened_by, opened_at FROM live_sessions WHERE course_id=?",
+                       (course_id,)).fetchone()
+    return dict(row)
+
+
+def close_session(conn, course_id):
+    """
+    Close the session for `course_id`. Returns this worker's counters for
+    it, or None if no session was open.
+    """
+    closed = conn.execute("DELETE FROM live_sessions WHERE course_id=?", (course_id,)).rowcount == 1
+    conn.commit()
+    cache.invalidate(TAG)
+    live = _live.pop(int(course_id), None)
+    if not closed:
+        return None
+    return dict(live.stats) if live is not None else {}
+
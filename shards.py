@@ -0,0 +1,236 @@
+# shards.py
+"""
+Sharded gallery matching. With GALLERY_SHARDS=N, N shard servers each
+hold every Nth gallery row (row i lives on shard i % N) and answer
+nearest-face queries over a Unix socket. match() scatters a batch to every
+shard and keeps, per query, the closest of the per-shard winners, so one
+frame's scan is split across N processes and no gunicorn worker holds
+the whole gallery.
+
+Shard servers run standalone with
+
+    python shards.py serve
+
+or, when some do not answer, those are spawned by the first worker that
+needs them (they then live as long as that worker). Each shard reloads its slice
+when the gallery files change; it scans exactly, whatever MATCHER_MODE,
+GALLERY_SCAN_DTYPE or TEMPLATE_MATCHING say.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+import numpy as np
+import gallery
+from gallery import EMBEDDING_DIM
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: no AF_UNIX sockets, leave GALLERY_SHARDS unset
+    fcntl = None
+
+SHARDS = int(os.getenv("GALLERY_SHARDS", "0"))
+SOCKET_DIR = os.getenv("GALLERY_SHARD_DIR", "shard_sockets")
+AUTHKEY = os.getenv("GALLERY_SHARD_AUTHKEY", "gallery-shards").encode()
+START_TIMEOUT_S = float(os.getenv("GALLERY_SHARD_START_TIMEOUT_S", "30"))
+ENABLED = SHARDS > 0
+
+_local = threading.local()
+
+
+def address(shard):
+    return os.path.join(SOCKET_DIR, f"shard-{shard}.sock")
+
+
+# -------------------------------
+# Shard server
+# -------------------------------
+class _Shard:
+    """One shard's slice of the gallery, reloaded when the files change"""
+
+    def __init__(self, shard, count):
+        self.shard = shard
+        self.count = count
+        self.version = object()
+        self.snapshot = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        version = gallery.disk_version()
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    self.snapshot = gallery.partition(self.shard, self.count)
+                    self.version = version
+        return self.snapshot
+
+
+def _handle(conn, state):
+    with conn:
+        while True:
+            try:
+                payload = conn.recv_bytes()
+            except (EOFError, OSError):
+                return
+            queries = np.frombuffer(payload, dtype="<f4").reshape(-1, EMBEDDING_DIM)
+            try:
+                conn.send(gallery.nearest_many(queries, state.current()))
+            except OSError:
+                return  # the client gave up on this batch (another shard failed) and hung up
+
+
+def _serve(shard, count, path):
+    """Process entry point: answer queries for `shard` of `count` on `path` until killed"""
+    # Held for the server's lifetime: the socket is only ours to replace if no live server holds it
+    lock = open(f"{path}.lock", "a")
+    if fcntl:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return  # another server already answers for this shard
+    if os.path.exists(path):
+        os.unlink(path)  # left behind by a server that died
+    state = _Shard(shard, count)
+    state.current()  # load before accepting, so the first query is not slow
+    with Listener(path, family="AF_UNIX", authkey=AUTHKEY) as listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, multiprocessing.AuthenticationError):
+                continue
+            threading.Thread(target=_handle, args=(conn, state), daemon=True).start()
+
+
+def start(count=None, shards=None):
+    """
+    Spawn the servers for `shards` (default all) of `count` (default
+    GALLERY_SHARDS) shards; returns the Process objects.
+    """
+    count = count or SHARDS
+    shards = range(count) if shards is None else shards
+    # spawn, not fork: shards must not inherit sqlite handles or request threads
+    ctx = multiprocessing.get_context("spawn")
+    os.makedirs(SOCKET_DIR, exist_ok=True)
+    processes = [ctx.Process(target=_serve, args=(shard, count, address(shard)), name=f"gallery-shard-{shard}", daemon=True)
+                 for shard in shards]
+    for process in processes:
+        process.start()
+    return processes
+
+
+# -------------------------------
+# Client
+# -------------------------------
+def _connect():
+    conns = []
+    try:
+        for shard in range(SHARDS):
+            conns.append(Client(address(shard), family="AF_UNIX", authkey=AUTHKEY))
+    except Exception:
+        for conn in conns:
+            conn.close()
+        raise
+    return conns
+
+
+def _fill(conns):
+    """Connect the None entries of `conns` to their shard; returns the shards still unreachable"""
+    for shard, conn in enumerate(conns):
+        if conn is None:
+            try:
+                conns[shard] = Client(address(shard), family="AF_UNIX", authkey=AUTHKEY)
+            except OSError:
+                pass
+    return [shard for shard, conn in enumerate(conns) if conn is None]
+
+
+def _start_and_connect():
+    """Connect, spawning only the shards that do not answer (one worker at a time)"""
+    os.makedirs(SOCKET_DIR, exist_ok=True)
+    with open(os.path.join(SOCKET_DIR, "start.lock"), "a") as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        conns = [None] * SHARDS
+        try:
+            missing = _fill(conns)
+            if missing:
+                start(shards=missing)
+                deadline = time.monotonic() + START_TIMEOUT_S
+                while missing:
+                    if time.monotonic() > deadline:
+                        raise ConnectionError(f"gallery shards {missing} did not start within {START_TIMEOUT_S}s")
+                    time.sleep(0.05)
+                    missing = _fill(conns)
+            return conns
+        except BaseException:
+            for conn in conns:
+                if conn is not None:
+                    conn.close()
+            raise
+
+
+def _connections():
+    """This thread's connection to every shard (one request in flight per connection)"""
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.conns, _local.pid = None, os.getpid()
+    if _local.conns is None:
+        try:
+            _local.conns = _connect()
+        except OSError:
+            _local.conns = _start_and_connect()
+    return _local.conns
+
+
+def _drop_connections():
+    for conn in _local.conns or ():
+        conn.close()
+    _local.conns = None
+
+
+def match(queries):
+    """
+    Nearest gallery face for each query row, over all shards: a list of
+    (name, distance) or (None, None) per query, like gallery.nearest_many.
+    """
+    queries = np.ascontiguousarray(queries, dtype="<f4").reshape(-1, EMBEDDING_DIM)
+    if len(queries) == 0:
+        return []
+    payload = queries.tobytes()
+    for attempt in range(2):
+        conns = _connections()
+        try:
+            for conn in conns:
+                conn.send_bytes(payload)
+            answers = [conn.recv() for conn in conns]
+            break
+        except (EOFError, OSError):
+            # A shard went away: reconnect (restarting the shards) and ask again once
+            _drop_connections()
+            if attempt:
+                raise
+
+    best = [(None, None)] * len(queries)
+    for answer in answers:
+        for i, (name, distance) in enumerate(answer):
+            if distance is not None and (best[i][1] is None or distance < best[i][1]):
+                best[i] = (name, distance)
+    return best
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the gallery shard servers (GALLERY_SHARDS of them)")
+    parser.add_argument("command", choices=["serve"])
+    parser.parse_args()
+    if not ENABLED:
+        parser.error("set GALLERY_SHARDS to the number of shards, the same value the web workers use")
+    processes = start()
+    print(f"serving {SHARDS} gallery shards in {SOCKET_DIR}/")
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,26 @@
-from flask import Blueprint, request, jsonify
-import sqlite3, numpy as np, os
+from flask import Blueprint, request, jsonify, g
+import io, os, sqlite3
+from db import get_db
+from auth import token_required
+import cache
+import enrollment
+import gallery
+import wire
 
 students_bp = Blueprint("students", __name__)
 
-# -------------------------------
-# Embeddings storage
-# -------------------------------
-EMBEDDINGS_FILE = "models/known_face_embeddings.npy"
-NAMES_FILE = "models/known_face_names.npy"
-
-if os.path.exists(EMBEDDINGS_FILE) and os.path.exists(NAMES_FILE):
-    known_face_embeddings = np.load(EMBEDDINGS_FILE, allow_pickle=True)
-    known_face_names = np.load(NAMES_FILE, allow_pickle=True)
-else:
-    known_face_embeddings = np.array([])
-    known_face_names = np.array([])
-
-
-def save_embeddings():
-    np.save(EMBEDDINGS_FILE, known_face_embeddings)
-    np.save(NAMES_FILE, known_face_names)
-
+# Face templates a student may register with (see gallery.TEMPLATE_MATCHING)
+MAX_TEMPLATES = int(os.getenv("MAX_TEMPLATES_PER_STUDENT", "10"))
 
 # -------------------------------
-# Student Registration (JSON with embedding)
+# Student Registration (JSON with one or more embeddings)
 # -------------------------------
 @students_bp.route("/register", methods=["POST"])
 def register_student():
-    global known_face_embeddings, known_face_names
-
-    data = request.get_json(silent=True)
+    try:
+        data, body = wire.read_request()
+    except wire.WireError as e:
+        return jsonify({"error": str(e)}), e.status
 
     if not data:
         return jsonify({"error": "Invalid JSON or no data provided"}), 400
@@ -40,7 +31,7 @@ def register_student():
     matric_number = (data.get("matric_number") or "").strip()
     level = (data.get("level") or "").strip()
     courses_offered = data.get("courses_offered", [])
-    embedding = data.get("embedding")
+    embedding = body if body is not None else data.get("embeddings", data.get("embedding"))
 
     # Validate required fields
     if not first_name:
@@ -49,16 +40,22 @@ def register_student():
         return jsonify({"error": "last_name is required"}), 400
     if not matric_number:
         return jsonify({"error": "matric_number is required"}), 400
+    # Checked before the INSERT: the gallery append after the commit would refuse it
+    if len(matric_number.encode("utf-8")) > gallery.NAME_BYTES:
+        return jsonify({"error": f"matric_number longer than {gallery.NAME_BYTES} bytes"}), 400
     if not level:
         return jsonify({"error": "level is required"}), 400
     if embedding is None:
         return jsonify({"error": "embedding is required"}), 400
 
-    embedding = np.array(embedding, dtype=np.float32)
-    if embedding.shape[0] != 128:
-        return jsonify({"error": f"embedding must be length 128, got {embedding.shape[0]}"}), 400
+    try:
+        embedding = wire.to_matrix(embedding)
+    except wire.WireError as e:
+        return jsonify({"error": str(e)}), e.status
+    if len(embedding) > MAX_TEMPLATES:
+        return jsonify({"error": f"at most {MAX_TEMPLATES} embeddings per student"}), 400
 
-    conn = sqlite3.connect("attendance.db")
+    conn = get_db()
     cursor = conn.cursor()
 
     try:
@@ -81,23 +78,54 @@ def register_student():
             cursor.execute("INSERT INTO student_courses (student_id, course_id) VALUES (?, ?)", (student_id, course_id))
 
         conn.commit()
+        cache.invalidate("enrollment", "courses")
 
-        # Save embedding
-        if len(known_face_embeddings) == 0:
-            known_face_embeddings = np.array([embedding])
-            known_face_names = np.array([matric_number])
-        else:
-            known_face_embeddings = np.vstack([known_face_embeddings, embedding])
-            known_face_names = np.append(known_face_names, matric_number)
-
-        save_embeddings()
+        # Save embeddings (visible to every worker on its next match)
+        gallery.append_many(embedding, [matric_number] * len(embedding))
 
         return jsonify({
             "message": f"Student {first_name} {last_name} registered successfully",
-            "student_id": student_id
+            "student_id": student_id,
+            "templates": len(embedding)
         })
 
     except sqlite3.IntegrityError:
+        conn.rollback()
         return jsonify({"error": "Matric number already exists"}), 400
-    finally:
-        conn.close()
+
+
+# -------------------------------
+# Bulk Import (NDJSON / CSV / .npz)
+# -------------------------------
+@students_bp.route("/import", methods=["POST"])
+@token_required
+def import_students():
+    if g.user.get("role") not in ["hod", "admin"]:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    upload = request.files.get("file")
+    if upload:
+        fmt = request.args.get("format") or upload.filename.rsplit(".", 1)[-1].lower()
+        source = upload.stream
+    else:
+        content_type = request.mimetype
+        fmt = request.args.get("format") or {"text/csv": "csv", "application/x-ndjson": "ndjson"}.get(content_type)
+        # Buffered so the readers can pull lines without a read() per byte
+        source = io.BufferedReader(request.stream, 1 << 16)
+
+    if fmt not in enrollment.READERS:
+        return jsonify({"error": "format must be one of: csv, ndjson, npz"}), 400
+    if fmt == "npz":
+        # np.load needs a seekable file; request bodies are read once
+        source = io.BytesIO(source.read())
+
+    conn = get_db()
+    try:
+        report = enrollment.import_students(conn, enrollment.READERS[fmt](source))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except sqlite3.IntegrityError:
+        # Another registration raced this batch; nothing was committed
+        return jsonify({"error": "Matric number registered concurrently, retry the import"}), 409
+
+    return jsonify(report)
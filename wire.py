@@ -0,0 +1,89 @@
+# wire.py
+"""
+Request decoding for endpoints that take embeddings. Besides the original
+JSON lists of floats, clients may send little-endian float32 bytes:
+
+- application/json with "embedding(s)" as a base64 string
+- application/msgpack with "embedding(s)" as a bin field (needs msgpack)
+- application/octet-stream with the raw bytes as the body and the other
+  fields in the query string
+
+Binary payloads are viewed with np.frombuffer, without a float per value.
+"""
+import base64
+import binascii
+import numpy as np
+from flask import request
+from gallery import EMBEDDING_DIM
+
+try:
+    import msgpack
+except ImportError:  # binary JSON-alternative is optional
+    msgpack = None
+
+EMBEDDING_DTYPE = np.dtype("<f4")
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+INT_FIELDS = ("course_id",)
+LIST_FIELDS = ("courses_offered",)
+
+
+class WireError(ValueError):
+    """The request body cannot be decoded; `status` is the HTTP code to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def read_request():
+    """
+    Return (fields, body_embeddings) for the current request. For
+    octet-stream bodies the fields come from the query string and
+    body_embeddings is the raw body; otherwise it is None and the
+    embeddings are inside the fields. fields is None if the body is unreadable.
+    """
+    mimetype = request.mimetype
+    if mimetype == "application/octet-stream":
+        fields = request.args.to_dict()
+        for key in INT_FIELDS:
+            if fields.get(key, "").isdigit():
+                fields[key] = int(fields[key])
+        for key in LIST_FIELDS:
+            if key in request.args:
+                fields[key] = request.args.getlist(key)
+        return fields, request.get_data()
+
+    if mimetype in MSGPACK_TYPES:
+        if msgpack is None:
+            raise WireError("msgpack payloads are not supported on this server", 415)
+        try:
+            data = msgpack.unpackb(request.get_data(), raw=False)
+        except (ValueError, msgpack.UnpackException):
+            data = None
+    else:
+        data = request.get_json(silent=True)
+    return (data if isinstance(data, dict) else None), None
+
+
+def to_matrix(value):
+    """
+    Decode embeddings sent as raw bytes, a base64 string or (nested) lists
+    of numbers into an M x 128 float32 matrix.
+    """
+    if isinstance(value, str):
+        try:
+            value = base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError):
+            raise WireError("embedding must be base64-encoded float32") from None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        if len(value) == 0 or len(value) % (EMBEDDING_DIM * EMBEDDING_DTYPE.itemsize):
+            raise WireError(f"binary embeddings must be a multiple of {EMBEDDING_DIM} float32 values")
+        matrix = np.frombuffer(value, dtype=EMBEDDING_DTYPE)
+    else:
+        try:
+            matrix = np.asarray(value, dtype=np.float32)
+        except (TypeError, ValueError):
+            raise WireError("embeddings must be numeric") from None
+        if matrix.ndim not in (1, 2) or matrix.shape[-1] != EMBEDDING_DIM:
+            raise WireError(f"each embedding must be length {EMBEDDING_DIM}")
+    return matrix.reshape(-1, EMBEDDING_DIM)
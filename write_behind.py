@@ -0,0 +1,263 @@
+# write_behind.py
+"""
+Optional write-behind path for attendance marks (WRITE_BEHIND=1).
+
+Accepted marks are appended to a per-process log and acknowledged once that
+log is fsynced; a background writer then inserts them into SQLite in grouped
+transactions. Both the fsync and the commit are shared by every mark that
+arrived within WRITE_BEHIND_DELAY_MS (or until WRITE_BEHIND_BATCH marks are
+waiting), so a check-in burst no longer takes the database write lock once
+per request. Logs left behind by a crashed worker are replayed by recover().
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import cache
+import db
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, no cross-worker lock needed
+    fcntl = None
+
+ENABLED = os.getenv("WRITE_BEHIND", "0") == "1"
+LOG_DIR = os.getenv("WRITE_BEHIND_DIR", "marks_log")
+BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH", "256"))
+DELAY_MS = float(os.getenv("WRITE_BEHIND_DELAY_MS", "1"))
+ACK_TIMEOUT_S = 10
+RETRY_S = 1  # how soon a failed commit is retried when no new marks arrive
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_state = {"pid": None, "writer": None}
+_pending = set()  # (course_id, student_id, session_date) logged but not yet committed
+
+
+class _Mark:
+    __slots__ = ("row", "done", "error")
+
+    def __init__(self, row):
+        self.row = row
+        self.done = threading.Event()
+        self.error = None
+
+
+class _Writer(threading.Thread):
+    """Drains the queue: one log fsync and one SQLite transaction per group"""
+
+    def __init__(self, path):
+        super().__init__(name="attendance-write-behind", daemon=True)
+        self.queue = queue.Queue()
+        self.log = open(path, "a+b")
+        if fcntl:
+            # Tells recover() in other workers that this log is still live
+            fcntl.flock(self.log, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.conn = None
+        self.uncommitted = self._adopt()
+
+    def _adopt(self):
+        """
+        Marks already in the log: left by a dead worker whose pid we reuse
+        and that no recover() has replayed yet (e.g. under --preload).
+        They are committed with the first group; a torn final line is cut
+        off so new records start on a line of their own.
+        """
+        self.log.seek(0)
+        rows, good = [], 0
+        for line in self.log:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("torn line")
+                rows.append(json.loads(line))
+            except ValueError:
+                break
+            good += len(line)
+        self.log.truncate(good)
+        if rows:
+            log.warning("write-behind adopted %d uncommitted marks from %s", len(rows), self.log.name)
+        return rows
+
+    def run(self):
+        self.conn = db.connect()
+        self._commit()
+        stopping = False
+        while not stopping:
+            group, stopping = self._next_group()
+            if group:
+                self._log(group)
+            self._commit()
+        self.conn.close()
+        self.log.close()
+        if self.uncommitted:
+            # Acknowledged but not in the database: leave the log for recover()
+            log.error("write-behind stopped with %d marks uncommitted; kept %s",
+                      len(self.uncommitted), self.log.name)
+        else:
+            os.unlink(self.log.name)
+
+    def _next_group(self):
+        try:
+            # With marks waiting on a failed commit, wake up to retry it
+            first = self.queue.get(timeout=RETRY_S if self.uncommitted else None)
+        except queue.Empty:
+            return [], False
+        if first is None:
+            return [], True
+        group = [first]
+        deadline = time.monotonic() + DELAY_MS / 1000
+        while len(group) < BATCH_SIZE:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                return group, True
+            group.append(item)
+        return group, False
+
+    def _log(self, group):
+        try:
+            self.log.write(b"".join(json.dumps(m.row).encode() + b"\n" for m in group))
+            self.log.flush()
+            os.fsync(self.log.fileno())
+        except OSError as exc:
+            for mark in group:
+                mark.error = exc
+                _release(mark.row)
+                mark.done.set()
+            return
+        self.uncommitted.extend(m.row for m in group)
+        for mark in group:
+            mark.done.set()
+
+    def _commit(self):
+        if not self.uncommitted:
+            return
+        try:
+            self.conn.executemany(db.INSERT_ATTENDANCE, self.uncommitted)
+            self.conn.commit()
+        except Exception:
+            # The rows are safe in the log; keep them and retry within RETRY_S
+            self.conn.rollback()
+            log.exception("write-behind commit failed, %d marks pending", len(self.uncommitted))
+            return
+        for row in self.uncommitted:
+            _release(row)
+        self.uncommitted = []
+        cache.invalidate("attendance")
+        # Everything logged so far is now in the database
+        self.log.truncate(0)
+
+
+def _key(row):
+    student_id, course_id, _, session_date = row
+    return course_id, student_id, session_date
+
+
+def _release(row):
+    with _lock:
+        _pending.discard(_key(row))
+
+
+def _writer():
+    """Writer for this process, started on first use (and again after a fork)"""
+    pid = os.getpid()
+    if _state["pid"] != pid:
+        with _lock:
+            if _state["pid"] != pid:
+                os.makedirs(LOG_DIR, exist_ok=True)
+                writer = _Writer(os.path.join(LOG_DIR, f"marks-{pid}.log"))
+                writer.start()
+                _pending.clear()
+                _state.update(pid=pid, writer=writer)
+    return _state["writer"]
+
+
+def submit(cursor, rows):
+    """
+    Queue attendance rows (student_id, course_id, timestamp, session_date)
+    and wait until they are durable in the log. Returns one bool per row:
+    False if that student is already marked for the session, either in the
+    database or still waiting in this process's queue.
+    """
+    writer = _writer()
+    results, marks = [], []
+    for row in rows:
+        key = _key(row)
+        with _lock:
+            claimed = key not in _pending
+            if claimed:
+                _pending.add(key)
+        if claimed:
+            cursor.execute("""SELECT 1 FROM attendance
+                              WHERE course_id=? AND student_id=? AND session_date=?""", key)
+            if cursor.fetchone():
+                _release(row)
+                claimed = False
+        if claimed:
+            mark = _Mark(row)
+            writer.queue.put(mark)
+            marks.append(mark)
+        results.append(claimed)
+
+    for mark in marks:
+        if not mark.done.wait(ACK_TIMEOUT_S):
+            raise TimeoutError("attendance write-behind log did not acknowledge in time")
+        if mark.error:
+            raise mark.error
+    return results
+
+
+def drain():
+    """Flush everything queued in this process; registered as an exit hook"""
+    if _state["pid"] != os.getpid():
+        return
+    writer = _state["writer"]
+    writer.queue.put(None)
+    writer.join()
+    _state.update(pid=None, writer=None)
+
+
+def recover():
+    """
+    Replay logs left by workers that exited without draining. Logs still
+    locked by a live worker are skipped; replay is idempotent because the
+    unique index turns already-committed rows into no-ops.
+    """
+    conn = db.connect()
+    for path in glob.glob(os.path.join(LOG_DIR, "marks-*.log")):
+        try:
+            fh = open(path, "rb")
+        except FileNotFoundError:
+            continue  # another worker booting alongside recovered it
+        with fh:
+            if fcntl:
+                try:
+                    fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+            if os.fstat(fh.fileno()).st_nlink == 0:
+                continue  # recovered and unlinked while we waited to open it
+            rows = []
+            for line in fh:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    break  # torn final line: that mark was never acknowledged
+            conn.executemany(db.INSERT_ATTENDANCE, rows)
+            conn.commit()
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            cache.invalidate("attendance")
+    conn.close()
+
+
+atexit.register(drain)